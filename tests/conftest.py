@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+# 画面・音声なしで動かす (Simulation などは display を初期化しなくても使える)
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy"); os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def game():
+    """画面を初期化した Game (メニュー・プロファイラ・共有プールを使うテスト用)"""
+    import pygame
+    import tsunami_game as tg
+    pygame.display.init(); pygame.font.init()
+    pygame.display.set_mode((tg.SCREEN_WIDTH, tg.SCREEN_HEIGHT))
+    yield tg.Game()
+    pygame.display.quit()
@@ -0,0 +1,23 @@
+"""温まった後のプレイでは新しい面もオブジェクトも作られないこと (Game.allocation_stats)"""
+
+import tsunami_game as tg
+from tests.test_simulation import bot_inputs
+
+SEEDS = ((1, "normal"), (2, "hard"), (3, "hard"))
+
+def play(game, seed, mode, inputs):
+    """bench と同じく、ゲームの共有アトラス・プールでシミュレーションを差し替えて最後まで進める"""
+    game.close_simulation(); game.sim = tg.Simulation(seed, mode, game.sprite_atlas, game.object_pool); game.sim.run(inputs)
+
+def test_repeated_games_allocate_nothing(game):
+    runs = [(seed, mode, bot_inputs(seed, mode)) for seed, mode in SEEDS]
+    for run in runs: play(game, *run)  # ウォームアップ
+    warm = game.allocation_stats()
+    for run in runs: play(game, *run)
+    after = game.allocation_stats()
+    assert after["surfaces_created"] == warm["surfaces_created"] and after["objects_created"] == warm["objects_created"]
+    assert after["objects_reused"] > warm["objects_reused"]
+
+def test_allocation_stats_are_exported(game):
+    assert game.profiler.extra_stats["allocations"]() == game.allocation_stats()
+    assert game.allocation_line() in [line() for line in game.profiler.extra_lines]
@@ -0,0 +1,18 @@
+"""窓の再表示での描き直しと、入力→表示の遅延の測り方"""
+import pygame
+
+import tsunami_game as tg
+
+def test_window_exposed_redraws_everything(game):
+    assert pygame.WINDOWEXPOSED in tg.ALLOWED_EVENTS
+    game.menu.full_redraw = False; game.dirty_renderer.force_full = False
+    assert game.handle_window_event(pygame.event.Event(pygame.WINDOWEXPOSED))
+    assert game.menu.full_redraw and game.dirty_renderer.force_full
+    assert not game.handle_window_event(pygame.event.Event(pygame.KEYDOWN, key=pygame.K_a))
+
+def test_latency_counts_from_previous_poll():
+    latency = tg.InputLatency()
+    latency.poll(0.0); latency.sample(0)
+    latency.poll(16.0); latency.sample(tg.INPUT_UP); latency.stepped(); latency.presented(30.0)
+    stats = latency.stats()
+    assert stats["count"] == 1 and stats["p50_ms"] == 30.0 and stats["sample_to_flip_p50_ms"] == 14.0
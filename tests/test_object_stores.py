@@ -0,0 +1,45 @@
+"""sprite (空間ハッシュ) と numpy (構造体配列) のオブジェクト置き場が同じ答えを返すこと"""
+import random
+
+import pygame
+import pytest
+
+import tsunami_game as tg
+from tests.test_simulation import bot_inputs
+
+pytestmark = pytest.mark.skipif(not tg.ObjectArrays.available(), reason="numpy がありません")
+
+def state_without_order(sim):
+    """置き場ごとに並び順が違う objects だけは集合として比べる"""
+    snapshot = sim.snapshot(); snapshot["objects"] = sorted(snapshot["objects"])
+    return snapshot
+
+def key(obj):
+    return obj.type, obj.world_x, obj.world_y
+
+def test_same_game_with_either_store():
+    for seed, mode in ((1, "normal"), (2, "hard"), (3, "hard")):
+        inputs = bot_inputs(seed, mode)
+        sprite = tg.Simulation(seed, mode, store="sprite"); sprite.run(inputs)
+        arrays = tg.Simulation(seed, mode, store="numpy"); arrays.run(inputs)
+        assert state_without_order(sprite) == state_without_order(arrays)
+
+def test_query_and_colliding_agree():
+    rng = random.Random(0)
+    sims = [tg.Simulation(2, "hard", params={"chunk_density": {"glass": 40.0}}, store=store) for store in ("sprite", "numpy")]
+    for sim in sims: sim.run(bytes((tg.INPUT_UP | tg.INPUT_LEFT,)) * 300)
+    px, py = sims[0].player.world_x, sims[0].player.world_y
+    for _ in range(200):
+        left = px + rng.uniform(-1500, 1500); top = py + rng.uniform(-1500, 1500)
+        right = left + rng.uniform(0, 800); bottom = top + rng.uniform(0, 800)
+        found = [sorted(map(key, sim.object_grid.query(left, top, right, bottom))) for sim in sims]
+        assert found[0] == found[1]
+        rect = pygame.Rect(rng.randrange(-100, tg.SCREEN_WIDTH), rng.randrange(-100, tg.SCREEN_HEIGHT), rng.randrange(1, 400), rng.randrange(1, 400))
+        hits = [sorted((key(obj), tuple(obj.rect)) for obj in sim.object_grid.colliding(rect, px, py)) for sim in sims]
+        assert hits[0] == hits[1]
+
+def test_switch_store_keeps_the_game_identical():
+    inputs = bot_inputs(4, "normal"); half = len(inputs) // 2
+    plain = tg.Simulation(4, "normal"); plain.run(inputs)
+    switched = tg.Simulation(4, "normal"); switched.run(inputs[:half]); switched.switch_store("numpy"); switched.run(inputs[half:])
+    assert state_without_order(plain) == state_without_order(switched)
@@ -0,0 +1,51 @@
+"""進行状況の保存 (スナップショット + 追記ログ) の復元と畳み込み"""
+import json
+
+import tsunami_game as tg
+
+def make_store(directory, compact_records=tg.SAVE_COMPACT_RECORDS):
+    store = tg.ProgressStore(tg.FileProgressBackend(str(directory)), compact_records=compact_records); store.load()
+    return store
+
+def test_values_survive_reload(tmp_path):
+    store = make_store(tmp_path)
+    store.set("sfx_volume", 0.3); store.set("ach.survived_1_min", True); store.set("sfx_volume", 0.2); store.flush()
+    assert make_store(tmp_path).values == {"sfx_volume": 0.2, "ach.survived_1_min": True}
+
+def test_truncated_last_log_line_is_ignored(tmp_path):
+    store = make_store(tmp_path)
+    store.set("bgm_volume", 0.7); store.flush(); store.set("hard_mode_unlocked", True); store.flush()
+    with open(tmp_path / "progress.log", "a") as f: f.write('[3, "sfx_vol')  # 書き込み途中で落ちた
+    assert make_store(tmp_path).values == {"bgm_volume": 0.7, "hard_mode_unlocked": True}
+
+def test_compaction_folds_log_into_snapshot(tmp_path):
+    store = make_store(tmp_path, compact_records=4)
+    for i in range(10): store.set(f"key{i % 3}", i); store.flush()
+    assert store.compactions >= 2
+    snapshot = json.loads((tmp_path / "progress.json").read_text())
+    assert snapshot["seq"] <= store.seq and len((tmp_path / "progress.log").read_text().splitlines()) < 4
+    assert make_store(tmp_path, compact_records=4).values == {"key0": 9, "key1": 7, "key2": 8}
+
+def test_crash_between_snapshot_and_log_truncation(tmp_path):
+    # スナップショットを置き換えた後、ログを空にする前に落ちた状態: 古いレコードは読み飛ばされる
+    backend = tg.FileProgressBackend(str(tmp_path))
+    backend.append([(1, "bgm_volume", 0.1), (2, "bgm_volume", 0.2)])
+    (tmp_path / "progress.json").write_text(json.dumps({"seq": 2, "values": {"bgm_volume": 0.9}}))
+    backend.append([(3, "sfx_volume", 0.4)])
+    store = make_store(tmp_path)
+    assert store.values == {"bgm_volume": 0.9, "sfx_volume": 0.4} and store.seq == 3
+
+class DictStorage:
+    """localStorage と同じ getItem / setItem / removeItem を持つ辞書"""
+    def __init__(self): self.items = {}
+    def getItem(self, key): return self.items.get(key)
+    def setItem(self, key, value): self.items[key] = value
+    def removeItem(self, key): self.items.pop(key, None)
+
+def test_browser_backend_round_trip_and_compaction():
+    storage = DictStorage()
+    store = tg.ProgressStore(tg.BrowserProgressBackend(storage), compact_records=3); store.load()
+    for i in range(7): store.set("sfx_volume", i / 10); store.flush()
+    assert store.compactions >= 2 and len([key for key in storage.items if ".log." in key]) < 3
+    reloaded = tg.ProgressStore(tg.BrowserProgressBackend(storage)); reloaded.load()
+    assert reloaded.values == {"sfx_volume": 0.6} and reloaded.seq == store.seq
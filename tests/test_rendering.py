@@ -0,0 +1,16 @@
+"""ダーティ矩形での描画: オーバーレイは矩形の数に関係なく 1 フレーム 1 回"""
+import pygame
+
+import tsunami_game as tg
+
+def test_overlay_drawn_once_per_frame(game):
+    renderer = tg.DirtyRectRenderer(); screen = pygame.display.get_surface()
+    painted = []; overlays = []
+    def overlay(screen):
+        overlays.append(1); return pygame.Rect(10, 150, 40, 40)
+    renderer.present(screen, painted.append, overlay)  # 最初は全面
+    assert painted == [None] and len(overlays) == 1
+    painted.clear(); overlays.clear()
+    for key, rect in (("a", (400, 10, 20, 20)), ("b", (600, 300, 20, 20)), ("c", (900, 500, 20, 20))): renderer.track(key, rect)
+    rects = renderer.present(screen, painted.append, overlay)
+    assert len(painted) == 3 and len(overlays) == 1 and pygame.Rect(10, 150, 40, 40) in rects
@@ -0,0 +1,46 @@
+"""リプレイの書き出し・読み込み・シーク"""
+import pytest
+
+import tsunami_game as tg
+from tests.test_simulation import bot_inputs
+
+def write_replay(path, seed, mode, inputs):
+    writer = tg.ReplayWriter(str(path), seed, mode)
+    for bits in inputs: writer.record(bits)
+    writer.close()
+
+def test_round_trip(tmp_path):
+    inputs = bot_inputs(2, "hard"); path = tmp_path / "run.tsr"
+    write_replay(path, 2, "hard", inputs)
+    assert tg.read_replay(str(path)) == (2, "hard", inputs)
+
+def test_headless_replay_matches_original(tmp_path):
+    inputs = bot_inputs(4, "normal"); path = tmp_path / "run.tsr"
+    original = tg.Simulation(4, "normal"); original.run(inputs)
+    write_replay(path, 4, "normal", inputs)
+    assert tg.ReplayPlayer(str(path)).run_headless().snapshot() == original.snapshot()
+
+def test_seek_matches_playing_from_start(tmp_path):
+    inputs = bot_inputs(6, "hard"); path = tmp_path / "run.tsr"
+    write_replay(path, 6, "hard", inputs)
+    player = tg.ReplayPlayer(str(path), snapshot_interval=100)
+    player.seek(len(inputs))  # 最後まで進めてスナップショットを揃える
+    for tick in (1000, 250, 0, 777, 1300, 999):  # 前後に飛ぶ
+        player.seek(tick)
+        expected = tg.Simulation(6, "hard"); expected.run(inputs[:tick])
+        assert player.sim.ticks == tick and player.sim.snapshot() == expected.snapshot()
+
+def test_rejects_other_versions(tmp_path):
+    path = tmp_path / "old.tsr"
+    path.write_bytes(tg.REPLAY_HEADER.pack(tg.REPLAY_MAGIC, tg.REPLAY_VERSION - 1, 0, 1, tg.TICK_RATE) + b"\x01" * 10)
+    with pytest.raises(ValueError): tg.read_replay(str(path))
+
+def test_rejects_bad_magic_tick_rate_and_short_files(tmp_path):
+    cases = {
+        "magic.tsr": tg.REPLAY_HEADER.pack(b"XXXX", tg.REPLAY_VERSION, 0, 1, tg.TICK_RATE),
+        "rate.tsr": tg.REPLAY_HEADER.pack(tg.REPLAY_MAGIC, tg.REPLAY_VERSION, 0, 1, tg.TICK_RATE + 1),
+        "short.tsr": tg.REPLAY_MAGIC,
+    }
+    for name, data in cases.items():
+        path = tmp_path / name; path.write_bytes(data)
+        with pytest.raises(ValueError): tg.read_replay(str(path))
@@ -0,0 +1,48 @@
+"""スコア検証サーバー: 形の違う送信は 400、正しい申告は valid"""
+import base64
+import http.client
+import json
+import threading
+
+import pytest
+
+import tsunami_game as tg
+from tests.test_simulation import bot_inputs
+from tools import verify_server
+
+@pytest.fixture(scope="module")
+def server():
+    server, verifier = verify_server.serve(0, workers=1)
+    thread = threading.Thread(target=server.serve_forever, daemon=True); thread.start()
+    yield server, verifier
+    server.shutdown(); server.server_close(); verifier.close()
+
+def post(server, body, content_length=None):
+    conn = http.client.HTTPConnection(*server[0].server_address, timeout=30)
+    conn.putrequest("POST", "/submit"); conn.putheader("Content-Length", str(len(body)) if content_length is None else content_length)
+    conn.endheaders(); conn.send(body)
+    response = conn.getresponse(); payload = json.loads(response.read()); conn.close()
+    return response.status, payload
+
+def submission(inputs=b"\x01", **claimed):
+    return json.dumps({"seed": 1, "mode": "normal", "inputs": base64.b64encode(inputs).decode(), "claimed": claimed}).encode()
+
+@pytest.mark.parametrize("body, content_length", [
+    (b"[1, 2]", None),
+    (json.dumps({"seed": 1, "mode": "normal", "inputs": "", "claimed": [1]}).encode(), None),
+    (submission(result=tg.STATE_GAME_OVER), None),  # height がない
+    (submission(result=tg.STATE_GAME_OVER, height=0, survival_time="abc"), None),
+    (submission(result=tg.STATE_GAME_OVER, height=0), "abc"),
+])
+def test_malformed_submissions_are_rejected(server, body, content_length):
+    counts = server[1].metrics.counts; before = counts["bad_request"]
+    status, payload = post(server, body, content_length)
+    assert status == 400 and "error" in payload
+    assert counts["bad_request"] == before + 1 and counts["errors"] == 0
+
+def test_honest_claim_is_valid_and_inflated_claim_is_not(server):
+    inputs = bot_inputs(1, "normal"); verified = tg.verify_run(1, "normal", inputs)
+    status, payload = post(server, submission(inputs, result=verified["result"], height=verified["height"], survival_time=verified["survival_time"]))
+    assert status == 200 and payload["valid"]
+    status, payload = post(server, submission(inputs, result=verified["result"], height=verified["height"] + 10))
+    assert status == 200 and not payload["valid"] and payload["mismatches"] == ["height"]
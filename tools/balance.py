@@ -0,0 +1,181 @@
+"""津波のバランス分析 (モンテカルロ)
+
+ボットに画面なしのゲームを大量にプレイさせ、モード×ボットごとの生存時間・クリア率・到達高度の分布を集計する。
+ゲームはシード単位のまとまりにしてプロセスプールへ配り、全コアで並列に回す。
+
+    python -m tools.balance --games 5000 --out balance_results
+    python -m tools.balance --modes hard --param glass_damage=45 --param respawn_delays='{"glass": 800}'
+"""
+import argparse
+import csv
+import json
+import math
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy"); os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tsunami_game as tg
+from tools.workers import init_worker, object_pool
+
+# --- ボット ---
+TSUNAMI_DANGER = 200  # 津波の前線がこの距離 (px) まで来たら何よりも上へ逃げる
+
+def steer(dx, dy, deadzone=4):
+    """目標への差分を INPUT_* のビット和にする"""
+    inputs = 0
+    if dy < -deadzone: inputs |= tg.INPUT_UP
+    elif dy > deadzone: inputs |= tg.INPUT_DOWN
+    if dx < -deadzone: inputs |= tg.INPUT_LEFT
+    elif dx > deadzone: inputs |= tg.INPUT_RIGHT
+    return inputs
+
+def nearest(sim, obj_type, below_penalty=2.0):
+    """保持範囲内で最も近い obj_type。津波側 (下) にあるものは遠く見積もる"""
+    player = sim.player; best = None; best_cost = math.inf
+    for obj in sim.object_grid.query(*sim.keep_rect()):
+        if obj.type != obj_type: continue
+        dx = obj.world_x - player.world_x; dy = obj.world_y - player.world_y
+        cost = math.hypot(dx, dy) * (below_penalty if dy > 0 else 1.0)
+        if cost < best_cost: best, best_cost = obj, cost
+    return best
+
+def tsunami_gap(sim):
+    return sim.tsunami.world_y - sim.player.world_y
+
+class RandomWalkBot:
+    """一定間隔でランダムな方向 (停止を含む) に向きを変える"""
+    name = "random_walk"
+    def __init__(self, seed, interval=30):
+        self.rng = random.Random(seed); self.interval = interval; self.inputs = 0
+
+    def __call__(self, sim):
+        if sim.ticks % self.interval == 0: self.inputs = self.rng.choice((0, tg.INPUT_UP, tg.INPUT_DOWN, tg.INPUT_LEFT, tg.INPUT_RIGHT, tg.INPUT_UP | tg.INPUT_LEFT, tg.INPUT_UP | tg.INPUT_RIGHT))
+        return self.inputs
+
+class StairSeekerBot:
+    """最寄りの階段へ一直線に向かう。階段が見えなければ上へ逃げる (ガラス片は避けない)"""
+    name = "stair_seeker"
+    def __init__(self, seed): pass
+
+    def __call__(self, sim):
+        if tsunami_gap(sim) < TSUNAMI_DANGER: return tg.INPUT_UP
+        target = nearest(sim, "stairs")
+        if target is None: return tg.INPUT_UP
+        return steer(target.world_x - sim.player.world_x, target.world_y - sim.player.world_y) or tg.INPUT_UP
+
+class StaminaAwareBot(StairSeekerBot):
+    """スタミナが減ったら緑の球を取りに行くか、津波が遠ければ立ち止まって回復する"""
+    name = "stamina_aware"
+    def __init__(self, seed, low=35, high=80, rest_gap=500):
+        self.low, self.high, self.rest_gap = low, high, rest_gap; self.resting = False
+
+    def __call__(self, sim):
+        gap = tsunami_gap(sim); stamina = sim.player.stamina
+        if gap < TSUNAMI_DANGER: self.resting = False; return tg.INPUT_UP
+        if stamina < self.low:
+            orb = nearest(sim, "green_orb")
+            if orb is not None: return steer(orb.world_x - sim.player.world_x, orb.world_y - sim.player.world_y) or tg.INPUT_UP
+            if gap > self.rest_gap: self.resting = True
+        if self.resting:
+            if stamina >= self.high or gap < self.rest_gap / 2: self.resting = False
+            else: return 0
+        return super().__call__(sim)
+
+POLICIES = {bot.name: bot for bot in (RandomWalkBot, StairSeekerBot, StaminaAwareBot)}
+
+# --- 1 ゲーム / 1 バッチ ---
+def play_one(seed, mode, policy, params=None, max_ticks=10 * 60 * tg.TICK_RATE, pool=None):
+    sim = tg.Simulation(seed, mode, pool=pool, params=params)
+    bot = POLICIES[policy](seed ^ 0x5EED)
+    step = sim.step
+    while sim.state == tg.STATE_PLAYING and sim.ticks < max_ticks: step(bot(sim))
+    if sim.state == tg.STATE_PLAYING: sim.final_survival_time = sim.time_ms() / 1000; sim.final_height = sim.player.height
+    sim.close()  # オブジェクトをワーカーのプールへ返して次のゲームで使い回す
+    return {
+        "mode": mode, "policy": policy, "seed": seed, "result": sim.state if sim.state != tg.STATE_PLAYING else "timeout",
+        "ticks": sim.ticks, "survival_time": sim.final_survival_time, "height": sim.final_height,
+        "target_height": sim.tsunami.target_height, "stamina": round(sim.player.stamina, 2), "chunks_generated": sim.chunks_generated,
+    }
+
+def run_batch(task):
+    mode, policy, seeds, params, max_ticks = task; pool = object_pool()
+    return [play_one(seed, mode, policy, params, max_ticks, pool) for seed in seeds]
+
+# --- 集計 ---
+HEIGHT_BUCKET = 50
+
+def percentile(sorted_values, q):
+    if not sorted_values: return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+def summarize(rows):
+    groups = {}
+    for row in rows: groups.setdefault((row["mode"], row["policy"]), []).append(row)
+    summary = []
+    for (mode, policy), group in sorted(groups.items()):
+        survival = sorted(row["survival_time"] for row in group); heights = sorted(row["height"] for row in group)
+        histogram = {}
+        for height in heights: bucket = height // HEIGHT_BUCKET * HEIGHT_BUCKET; histogram[bucket] = histogram.get(bucket, 0) + 1
+        summary.append({
+            "mode": mode, "policy": policy, "games": len(group),
+            "clear_rate": sum(row["result"] == tg.STATE_CLEAR for row in group) / len(group),
+            "timeout_rate": sum(row["result"] == "timeout" for row in group) / len(group),
+            "survival_mean": sum(survival) / len(survival), "survival_p50": percentile(survival, 0.5), "survival_p90": percentile(survival, 0.9),
+            "height_mean": sum(heights) / len(heights), "height_p50": percentile(heights, 0.5), "height_p90": percentile(heights, 0.9), "height_max": heights[-1],
+            "height_histogram": {str(bucket): count for bucket, count in sorted(histogram.items())},
+        })
+    return summary
+
+def write_results(out_dir, rows, summary, meta):
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, "games.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0])); writer.writeheader(); writer.writerows(rows)
+    with open(os.path.join(out_dir, "summary.csv"), "w", newline="") as f:
+        fields = [key for key in summary[0] if key != "height_histogram"]
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore"); writer.writeheader(); writer.writerows(summary)
+    with open(os.path.join(out_dir, "summary.json"), "w") as f: json.dump({"meta": meta, "summary": summary}, f, ensure_ascii=False, indent=2)
+
+def parse_param(text):
+    """key=value (value は JSON として読めなければ文字列のまま)"""
+    key, _, value = text.partition("=")
+    try: value = json.loads(value)
+    except ValueError: pass
+    return key, value
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ボットに大量のゲームを画面なしでプレイさせ、バランスを集計する")
+    parser.add_argument("--games", type=int, default=1000, help="モード×ボットごとのゲーム数")
+    parser.add_argument("--modes", nargs="+", default=list(tg.REPLAY_MODES), choices=tg.REPLAY_MODES)
+    parser.add_argument("--policies", nargs="+", default=list(POLICIES), choices=list(POLICIES))
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--batch", type=int, default=50, help="1 タスクにまとめるゲーム数")
+    parser.add_argument("--max-minutes", type=float, default=10, help="これを超えたゲームは timeout として打ち切る")
+    parser.add_argument("--seed", type=int, default=0, help="最初のシード (以降連番)")
+    parser.add_argument("--param", action="append", default=[], type=parse_param, help="シミュレーションのパラメータ上書き key=value")
+    parser.add_argument("--out", default="balance_results")
+    args = parser.parse_args(argv)
+
+    params = dict(args.param); max_ticks = int(args.max_minutes * 60 * tg.TICK_RATE)
+    for mode in args.modes: tg.sim_params(mode, params)  # 未知のキーは分散する前に弾く
+    seeds = list(range(args.seed, args.seed + args.games))
+    tasks = [(mode, policy, seeds[i:i + args.batch], params, max_ticks) for mode in args.modes for policy in args.policies for i in range(0, len(seeds), args.batch)]
+
+    start = time.perf_counter(); rows = []
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker) as executor:
+        for batch in executor.map(run_batch, tasks): rows.extend(batch)
+    elapsed = time.perf_counter() - start
+
+    summary = summarize(rows)
+    meta = {"games": len(rows), "seconds": round(elapsed, 2), "games_per_minute": round(len(rows) / elapsed * 60), "workers": args.workers, "params": params, "max_ticks": max_ticks}
+    write_results(args.out, rows, summary, meta)
+    for entry in summary:
+        print(f"{entry['mode']:6} {entry['policy']:13} games={entry['games']:6} clear={entry['clear_rate']:6.1%} survival p50={entry['survival_p50']:7.1f}s height p50={entry['height_p50']:5} p90={entry['height_p90']:5}")
+    print(f"{len(rows)} games in {elapsed:.1f}s ({meta['games_per_minute']} games/min, {args.workers} workers) -> {args.out}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""ベンチマーク (画面・音声なしのダミードライバーで実行)
+
+決まったシナリオを本物のループ (show_title_screen / play_game) で一定フレーム数だけ回し、
+フレーム/秒・1 フレームあたりの確保量・ピークメモリ・入力から表示までの遅延を測る。基準値を JSON に保存しておけば、
+次回からはそれと比べて閾値を超えて悪くなったシナリオがあると終了コード 1 で失敗する。
+tracemalloc には SDL の面のピクセルが見えないので、ウォームアップ後に作られた面・オブジェクト・テキストの描画回数
+(ゲーム側のカウンタ) とプロセスの最大常駐メモリも記録する。面とテキストの描画は基準値に関係なく 0 でなければ失敗にする。
+
+    python -m tools.bench --save                    # 基準値を bench_baseline.json に保存
+    python -m tools.bench --threshold 0.15          # 基準値と比べる (15% を超える悪化で失敗)
+    python -m tools.bench --scenarios objects_10k --store numpy
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+try: import resource
+except ImportError: resource = None  # Windows にはない (最大常駐メモリは記録しない)
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy"); os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pygame
+import tsunami_game as tg
+
+BASELINE = "bench_baseline.json"
+WARMUP_FRAMES = 60  # キャッシュが温まるまでのフレームは数えない
+ALLOC_FLOOR_KB = 4  # これ未満の確保量/メモリの増加は揺れとみなす
+RSS_FLOOR_KB = 1024; OBJECTS_FLOOR = 8  # 最大常駐メモリ・作られたオブジェクト数の揺れの幅
+CHURN_SCENARIOS = ("hud_text_churn",)  # わざと毎フレーム文字を描き直すので、テキストの描画回数は判定しない
+
+# --- 計測 ---
+class BenchProfiler(tg.FrameProfiler):
+    """ゲームの各ループが毎フレーム呼ぶ frame() に相乗りして、フレームを数えて決めた数で QUIT を投げる。
+    trace=True のときは tracemalloc で 1 フレームごとの一時的な確保量 (ピーク - 開始時) も記録する"""
+    def __init__(self, frames, trace=False):
+        super().__init__(capacity=frames)
+        self.limit = WARMUP_FRAMES + frames; self.trace = trace
+        self.count = 0; self.start = None; self.frame_start_bytes = 0; self.alloc_kb = []
+        self.game = None; self.warm_counters = None  # ウォームアップ直後のゲーム側カウンタ
+
+    def frame(self):
+        self.count += 1
+        if self.count == WARMUP_FRAMES + 1: self.start = time.perf_counter(); self.reset(); self.warm_counters = counters(self.game)
+        super().frame()
+        if self.trace:
+            current, peak = tracemalloc.get_traced_memory()
+            if self.count > WARMUP_FRAMES + 1: self.alloc_kb.append((peak - self.frame_start_bytes) / 1024)
+            tracemalloc.reset_peak(); self.frame_start_bytes = current
+        if self.count > self.limit: pygame.event.post(pygame.event.Event(pygame.QUIT))
+
+    def done(self):
+        return self.count > self.limit
+
+def counters(game):
+    """ウォームアップ後に増えてはいけないもの (tracemalloc では見えない面の確保を含む)"""
+    allocations = game.allocation_stats()
+    return {"surfaces_created": allocations["surfaces_created"], "objects_created": allocations["objects_created"], "text_renders": tg.TEXT_CACHE.misses}
+
+def peak_rss_kb():
+    """プロセス全体の最大常駐メモリ (Linux の ru_maxrss は KB、macOS はバイト)"""
+    if resource is None: return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+class OneTickStepper(tg.FixedStepper):
+    """実時間に関係なく 1 フレーム 1 ティック進める (どの環境でも同じ仕事量にする)"""
+    def advance(self, elapsed_ms): return 1
+    def alpha(self): return 1.0
+
+INPUT_PATTERN = (tg.INPUT_UP, tg.INPUT_UP | tg.INPUT_LEFT, tg.INPUT_UP, tg.INPUT_UP | tg.INPUT_RIGHT)
+
+def scripted_input(game):
+    """30 ティックごとに斜め上を切り替えながら上へ逃げる"""
+    return lambda: INPUT_PATTERN[game.sim.ticks // 30 % len(INPUT_PATTERN)]
+
+# --- シナリオ ---
+async def title_idle(game, store):
+    game.game_state = tg.STATE_TITLE
+    while game.running and not game.profiler.done(): await game.show_title_screen()
+
+def play_scenario(mode, params=None, seed=1):
+    async def run(game, store):
+        game.is_hard_mode = mode == "hard"; game.object_store = store; game.read_input = scripted_input(game)
+        while game.running and not game.profiler.done():
+            # 勝敗がついたら同じシードでやり直す (記録は残さない)
+            game.close_simulation(); game.sim = tg.Simulation(seed, mode, game.sprite_atlas, game.object_pool, params)
+            game.replay = None; game.attach_simulation(); game.game_state = tg.STATE_PLAYING
+            await game.play_game()
+    return run
+
+async def hud_text_churn(game, store):
+    """毎フレーム値の変わる文字列を大量に描く (テキストキャッシュの追い出しと再描画)"""
+    screen = game.screen; profiler = game.profiler; fonts = (game.font_small, game.font_medium)
+    labels = HUD_CHURN_LABELS; n = 0
+    while not profiler.done():
+        profiler.frame(); game.clock.tick(tg.FPS); profiler.mark("idle")
+        if any(event.type == pygame.QUIT for event in pygame.event.get()): break
+        screen.fill(tg.BLACK)
+        for i, label in enumerate(labels):
+            tg.draw_text(screen, label.format(n * (i + 1) % 997), fonts[i % 2], tg.WHITE, 20 + i % 4 * 310, 20 + i // 4 * 60, align="topleft")
+        profiler.mark("draw"); pygame.display.flip(); profiler.mark("flip"); n += 1
+        await asyncio.sleep(0)
+
+HUD_CHURN_LABELS = ("スタミナ: {}", "目標: {} m", "高さ: {} m", "津波との距離: {} m", "更新ピクセル: {}", "p50 {} ms", "objects x{}", "FPS {}") * 5
+
+SCENARIOS = {
+    "title_idle": title_idle,
+    "normal_play": play_scenario("normal"),
+    "hard_glass_storm": play_scenario("hard", {"chunk_density": {"glass": 12.0}}),
+    "objects_1k": play_scenario("normal", {"chunk_density": {"glass": 48.0}, "glass_damage": 0}),
+    "objects_10k": play_scenario("normal", {"chunk_density": {"glass": 500.0}, "glass_damage": 0}),
+    "hud_text_churn": hud_text_churn,
+}
+
+def make_game(screen, profiler):
+    game = tg.Game(); game.screen = screen; game.running = True
+    for obj_type in tg.OBJECT_TYPES: game.sprite_atlas.get(obj_type)  # 初めて出る種類の画像作成をウォームアップ扱いにする
+    game.profiler = profiler; profiler.game = game; game.stepper = OneTickStepper(); game.governor.enabled = False  # 品質を変えずに測る
+    return game
+
+def run_pass(name, screen, frames, store, trace):
+    """シナリオを 1 回流して (profiler, game) を返す。テキストキャッシュは毎回空にする"""
+    tg.TEXT_CACHE.clear()
+    profiler = BenchProfiler(frames, trace); game = make_game(screen, profiler)
+    if trace: tracemalloc.start(); tracemalloc.reset_peak()
+    try: asyncio.run(SCENARIOS[name](game, store))
+    finally:
+        peak_kb = tracemalloc.get_traced_memory()[1] / 1024 if trace else None
+        if trace: tracemalloc.stop()
+    return profiler, game, peak_kb
+
+def run_scenario(name, screen, frames, store):
+    # 時間は tracemalloc なしで測り、確保量はもう 1 回流して測る (tracemalloc は何倍も遅くなるため)
+    profiler, game, _ = run_pass(name, screen, frames, store, trace=False)
+    seconds = time.perf_counter() - profiler.start; stats = profiler.stats()
+    end = counters(game); growth = {key: end[key] - profiler.warm_counters[key] for key in end}
+    traced, _, peak_kb = run_pass(name, screen, frames, store, trace=True)
+    sim = getattr(game, "sim", None)
+    return {
+        "frames": frames, "seconds": round(seconds, 3), "fps": round(frames / seconds, 1),
+        "p50_ms": round(stats["p50_ms"], 3), "p99_ms": round(stats["p99_ms"], 3),
+        "alloc_kb_per_frame": round(sum(traced.alloc_kb) / max(1, len(traced.alloc_kb)), 2), "peak_kb": round(peak_kb, 1),
+        "objects": sim.object_grid.count if sim else 0, "input_p95_ms": round(game.input_latency.stats()["p95_ms"], 3),
+        "surfaces_created": growth["surfaces_created"], "objects_created": growth["objects_created"],
+        "text_renders_per_frame": round(growth["text_renders"] / frames, 3), "peak_rss_kb": peak_rss_kb(),
+    }
+
+# --- 基準値との比較 ---
+def compare(results, baseline, threshold):
+    """閾値を超えて悪化した項目の説明のリスト (fps は下がったら、確保量とメモリは増えたら悪化)。
+    ウォームアップ後の面の作成とテキストの描画は基準値がなくても 0 でなければ失敗"""
+    failures = []
+    for name, result in results.items():
+        if result["surfaces_created"]: failures.append(f"{name}: ウォームアップ後に面を {result['surfaces_created']} 枚作りました")
+        if name not in CHURN_SCENARIOS and result["text_renders_per_frame"] > 0:
+            failures.append(f"{name}: ウォームアップ後もテキストを描き直しています ({result['text_renders_per_frame']} 回/フレーム)")
+        base = baseline.get(name)
+        if base is None: continue
+        if result["fps"] < base["fps"] * (1 - threshold):
+            failures.append(f"{name}: fps {base['fps']} -> {result['fps']} ({result['fps'] / base['fps'] - 1:+.1%})")
+        for key in ("alloc_kb_per_frame", "peak_kb"):
+            if result[key] > base[key] * (1 + threshold) and result[key] - base[key] > ALLOC_FLOOR_KB:
+                failures.append(f"{name}: {key} {base[key]} -> {result[key]} ({result[key] / max(base[key], 1e-9) - 1:+.1%})")
+        for key, floor in (("objects_created", OBJECTS_FLOOR), ("peak_rss_kb", RSS_FLOOR_KB)):
+            if key in base and result[key] > base[key] * (1 + threshold) and result[key] - base[key] > floor:
+                failures.append(f"{name}: {key} {base[key]} -> {result[key]}")
+    return failures
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="決まったシナリオを画面なしで回して性能を測り、基準値と比べる")
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--frames", type=int, default=600, help="シナリオごとに測るフレーム数 (ウォームアップを除く)")
+    parser.add_argument("--store", default="sprite", choices=list(tg.OBJECT_STORES), help="オブジェクト置き場")
+    parser.add_argument("--baseline", default=BASELINE, help="比べる/保存する基準値の JSON")
+    parser.add_argument("--save", action="store_true", help="今回の結果を基準値として保存する (比較はしない)")
+    parser.add_argument("--threshold", type=float, default=0.10, help="これを超える割合で悪化したら失敗")
+    parser.add_argument("--out", help="今回の結果を JSON で書き出す")
+    args = parser.parse_args(argv)
+    if not tg.OBJECT_STORES[args.store].available(): parser.error(f"オブジェクト置き場 {args.store} はこの環境では使えません (numpy がありません)")
+
+    tg.FPS = 0  # clock.tick で待たない
+    pygame.display.init(); pygame.font.init()
+    screen = pygame.display.set_mode((tg.SCREEN_WIDTH, tg.SCREEN_HEIGHT))
+    results = {}
+    for name in args.scenarios:
+        results[name] = result = run_scenario(name, screen, args.frames, args.store)
+        print(f"{name:17} {result['fps']:8.1f} fps  p50 {result['p50_ms']:6.2f} ms  p99 {result['p99_ms']:6.2f} ms  "
+              f"alloc {result['alloc_kb_per_frame']:7.2f} KB/frame  peak {result['peak_kb']:9.1f} KB  objects {result['objects']}  input p95 {result['input_p95_ms']:.2f} ms  "
+              f"new surfaces {result['surfaces_created']}  new objects {result['objects_created']}  text {result['text_renders_per_frame']}/frame  rss {result['peak_rss_kb']} KB")
+    pygame.quit()
+
+    meta = {"python": platform.python_version(), "pygame": pygame.version.ver, "machine": platform.machine(), "store": args.store, "frames": args.frames}
+    if args.out:
+        with open(args.out, "w") as f: json.dump({"meta": meta, "scenarios": results}, f, ensure_ascii=False, indent=2)
+    if args.save:
+        with open(args.baseline, "w") as f: json.dump({"meta": meta, "scenarios": results}, f, ensure_ascii=False, indent=2)
+        print(f"基準値を保存しました -> {args.baseline}"); return 0
+    if not os.path.exists(args.baseline): print(f"基準値がありません ({args.baseline})。--save で作成してください。"); return 0
+    with open(args.baseline) as f: baseline = json.load(f)
+    if baseline["meta"].get("store") != args.store: print(f"★ 基準値のオブジェクト置き場 ({baseline['meta'].get('store')}) が今回 ({args.store}) と違います")
+    failures = compare(results, baseline["scenarios"], args.threshold)
+    for failure in failures: print("悪化:", failure)
+    print(f"{len(failures)} 件の悪化 (閾値 {args.threshold:.0%})" if failures else f"悪化なし (閾値 {args.threshold:.0%})")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,240 @@
+"""スコア検証サーバー (localhost 専用)
+
+クライアントが送ってきたプレイ (シード・モード・入力列) を画面なしで再生し直し、申告された結果
+(勝敗・到達高度・生存時間) と一致するかを確かめる。再生はプロセスプールで全コアに分散する。
+受け付けられる件数には上限があり、溢れたら 503 (Retry-After 付き) を返して送り手を待たせる。
+同じ内容の送信は結果をキャッシュから返し、処理中のものとは 1 つの再生を共有する。
+
+    python -m tools.verify_server --port 8765 --workers 4
+    python -m tools.verify_server --submit replays/last.tsr --result game_over --height 34 --survival 47.22
+
+    POST /submit   {"seed": 1, "mode": "normal", "inputs": "<base64>", "claimed": {"result": ..., "height": ..., "survival_time": ...}}
+                   (claimed の result と height は必須、survival_time は任意)
+    GET  /result/<id>
+    GET  /metrics
+"""
+import argparse
+import base64
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy"); os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tsunami_game as tg
+from tools.workers import init_worker, object_pool
+
+HOST = "127.0.0.1"  # 外からは受け付けない
+MAX_RUN_TICKS = 30 * 60 * tg.TICK_RATE  # 30 分を超える入力列は受け付けない
+MAX_BODY = 4 * MAX_RUN_TICKS  # base64 と JSON の分を見込んだ上限
+SURVIVAL_TOLERANCE = 1 / tg.TICK_RATE  # 生存時間は 1 ティック分までの丸め誤差を許す
+VERIFY_TIMEOUT = 60
+
+# --- ワーカープロセス側 ---
+def verify_job(seed, mode, inputs):
+    start = time.perf_counter(); verified = tg.verify_run(seed, mode, inputs, object_pool())
+    verified["simulate_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return verified
+
+# --- 送信内容 ---
+class BadSubmission(ValueError):
+    pass
+
+def parse_submission(body):
+    """(id, seed, mode, inputs, claimed) を返す。id は seed・mode・入力列の SHA-256"""
+    try: data = json.loads(body)
+    except ValueError: raise BadSubmission("JSON として読めません")
+    if not isinstance(data, dict): raise BadSubmission("送信内容は JSON オブジェクトです")
+    seed, mode, claimed = data.get("seed"), data.get("mode"), parse_claimed(data.get("claimed"))
+    if not is_int(seed) or not 0 <= seed < 2 ** 32: raise BadSubmission("seed は 0 以上 2^32 未満の整数です")
+    if not isinstance(mode, str) or mode not in tg.REPLAY_MODES: raise BadSubmission(f"mode は {tg.REPLAY_MODES} のどれかです")
+    if not isinstance(data.get("inputs", ""), str): raise BadSubmission("inputs は base64 の文字列です")
+    try: inputs = base64.b64decode(data.get("inputs", ""), validate=True)
+    except ValueError: raise BadSubmission("inputs は base64 です")
+    if len(inputs) > MAX_RUN_TICKS: raise BadSubmission(f"入力列が長すぎます ({len(inputs)} > {MAX_RUN_TICKS} ティック)")
+    if inputs.translate(None, bytes(range(0x10))): raise BadSubmission("inputs に INPUT_* 以外のビットがあります")
+    digest = hashlib.sha256(seed.to_bytes(4, "little") + mode.encode() + b"\0" + inputs).hexdigest()
+    return digest, seed, mode, inputs, claimed
+
+CLAIM_RESULTS = (tg.STATE_GAME_OVER, tg.STATE_CLEAR)  # 勝敗のついていないプレイは申告できない
+
+def is_int(value): return isinstance(value, int) and not isinstance(value, bool)
+
+def parse_claimed(claimed):
+    """申告は result と height が必須、survival_time は任意 (型が違えば BadSubmission)"""
+    if not isinstance(claimed, dict): raise BadSubmission("claimed は JSON オブジェクトです")
+    if claimed.get("result") not in CLAIM_RESULTS: raise BadSubmission(f"claimed.result は {CLAIM_RESULTS} のどれかです")
+    if not is_int(claimed.get("height")): raise BadSubmission("claimed.height は整数です")
+    survival_time = claimed.get("survival_time")
+    if survival_time is not None and (isinstance(survival_time, bool) or not isinstance(survival_time, (int, float))): raise BadSubmission("claimed.survival_time は数値です")
+    return {key: claimed[key] for key in ("result", "height", "survival_time") if claimed.get(key) is not None}
+
+def judge(claimed, verified):
+    """申告と再生結果の食い違い (survival_time は申告があるときだけ比べる)"""
+    mismatches = []
+    if claimed["result"] != verified["result"]: mismatches.append("result")
+    if claimed["height"] != verified["height"]: mismatches.append("height")
+    if "survival_time" in claimed and not abs(claimed["survival_time"] - verified["survival_time"]) <= SURVIVAL_TOLERANCE: mismatches.append("survival_time")
+    return mismatches
+
+# --- 計測値 ---
+class Metrics:
+    """受付・検証・拒否の件数と、受付から結果が出るまでの時間 (直近 LATENCY_WINDOW 件)"""
+    LATENCY_WINDOW = 1000; RATE_WINDOW = 60
+
+    def __init__(self):
+        self.lock = threading.Lock(); self.started = time.time()
+        self.counts = {"submitted": 0, "verified": 0, "valid": 0, "invalid": 0, "cache_hits": 0, "joined": 0, "rejected_busy": 0, "bad_request": 0, "errors": 0}
+        self.latencies = deque(maxlen=self.LATENCY_WINDOW); self.finished_at = deque()
+
+    def count(self, key, n=1):
+        with self.lock: self.counts[key] += n
+
+    def finished(self, seconds, valid):
+        now = time.time()
+        with self.lock:
+            self.counts["verified"] += 1; self.counts["valid" if valid else "invalid"] += 1
+            self.latencies.append(seconds); self.finished_at.append(now)
+            while self.finished_at and self.finished_at[0] < now - self.RATE_WINDOW: self.finished_at.popleft()
+
+    def snapshot(self, in_flight, capacity):
+        now = time.time()
+        with self.lock:
+            latencies = sorted(self.latencies); counts = dict(self.counts)
+            recent = sum(1 for t in self.finished_at if t >= now - self.RATE_WINDOW)
+        def pct(q): return round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 2) if latencies else 0.0
+        uptime = now - self.started
+        return dict(counts, in_flight=in_flight, capacity=capacity, uptime_s=round(uptime, 1),
+                    runs_per_s=round(counts["verified"] / uptime, 2) if uptime else 0.0, runs_per_s_last_minute=round(recent / min(uptime, self.RATE_WINDOW), 2) if uptime else 0.0,
+                    latency_ms={"p50": pct(0.5), "p95": pct(0.95), "p99": pct(0.99), "max": pct(1.0)})
+
+# --- 検証の受付 ---
+class Verifier:
+    """プロセスプールの前に上限付きの受付枠を置く。処理中 + 待ちが capacity に達したら新しい送信は断る"""
+    def __init__(self, workers=None, queue_size=64, cache_size=4096):
+        self.workers = workers or os.cpu_count(); self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker)
+        self.capacity = self.workers + queue_size
+        self.lock = threading.Lock(); self.in_flight = {}  # id -> Future (同じ送信はこれを共有する)
+        self.cache = OrderedDict(); self.cache_size = cache_size
+        self.metrics = Metrics()
+
+    def cached(self, run_id):
+        with self.lock:
+            verified = self.cache.get(run_id)
+            if verified is not None: self.cache.move_to_end(run_id)
+            return verified
+
+    def verify(self, run_id, seed, mode, inputs):
+        """再生結果を返す。受付枠が一杯なら None"""
+        with self.lock:
+            verified = self.cache.get(run_id); future = self.in_flight.get(run_id)
+            if verified is not None: self.cache.move_to_end(run_id); self.metrics.count("cache_hits"); return verified
+            if future is not None: self.metrics.count("joined"); submitted = False
+            elif len(self.in_flight) >= self.capacity: self.metrics.count("rejected_busy"); return None
+            else: future = self.in_flight[run_id] = self.executor.submit(verify_job, seed, mode, inputs); submitted = True
+        # 終わっていればその場で呼ばれるので、ロックの外で登録する
+        if submitted: future.add_done_callback(lambda done: self._store(run_id, done))
+        return future.result(timeout=VERIFY_TIMEOUT)
+
+    def _store(self, run_id, future):
+        with self.lock:
+            self.in_flight.pop(run_id, None)
+            if future.cancelled() or future.exception() is not None: return
+            self.cache[run_id] = future.result()
+            while len(self.cache) > self.cache_size: self.cache.popitem(last=False)
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+class Handler(BaseHTTPRequestHandler):
+    server_version = "TsunamiVerify/1"
+    verifier = None  # serve() で設定する
+
+    def send_json(self, status, payload, headers=()):
+        body = json.dumps(payload, ensure_ascii=False).encode()
+        self.send_response(status); self.send_header("Content-Type", "application/json; charset=utf-8"); self.send_header("Content-Length", str(len(body)))
+        for key, value in headers: self.send_header(key, value)
+        self.end_headers(); self.wfile.write(body)
+
+    def do_GET(self):
+        verifier = self.verifier
+        if self.path == "/metrics": return self.send_json(200, verifier.metrics.snapshot(len(verifier.in_flight), verifier.capacity))
+        if self.path.startswith("/result/"):
+            verified = verifier.cached(self.path[len("/result/"):])
+            return self.send_json(200, verified) if verified is not None else self.send_json(404, {"error": "未検証です"})
+        self.send_json(404, {"error": "見つかりません"})
+
+    def do_POST(self):
+        verifier = self.verifier; metrics = verifier.metrics
+        if self.path != "/submit": return self.send_json(404, {"error": "見つかりません"})
+        try: length = int(self.headers.get("Content-Length") or 0)
+        except ValueError: length = -1
+        if length < 0: metrics.count("bad_request"); return self.send_json(400, {"error": "Content-Length が不正です"})
+        if length > MAX_BODY: metrics.count("bad_request"); return self.send_json(413, {"error": "送信が大きすぎます"})
+        accepted = time.perf_counter()
+        try: run_id, seed, mode, inputs, claimed = parse_submission(self.rfile.read(length))
+        except BadSubmission as e: metrics.count("bad_request"); return self.send_json(400, {"error": str(e)})
+        metrics.count("submitted")
+        try: verified = verifier.verify(run_id, seed, mode, inputs)
+        except FutureTimeout: metrics.count("errors"); return self.send_json(504, {"error": "検証が時間内に終わりませんでした", "id": run_id})
+        except Exception as e: metrics.count("errors"); return self.send_json(500, {"error": f"検証に失敗しました: {e}", "id": run_id})
+        if verified is None: return self.send_json(503, {"error": "混み合っています。しばらくしてから送り直してください"}, [("Retry-After", "1")])
+        mismatches = judge(claimed, verified)
+        valid = verified["result"] != "incomplete" and not mismatches
+        metrics.finished(time.perf_counter() - accepted, valid)
+        self.send_json(200, {"id": run_id, "valid": valid, "mismatches": mismatches, "claimed": claimed, "verified": verified})
+
+    def log_message(self, format, *args):
+        pass  # 1 リクエストごとのログは出さない (/metrics を見る)
+
+def serve(port, workers=None, queue_size=64, cache_size=4096):
+    verifier = Verifier(workers, queue_size, cache_size)
+    server = ThreadingHTTPServer((HOST, port), type("BoundHandler", (Handler,), {"verifier": verifier}))
+    server.daemon_threads = True
+    return server, verifier
+
+# --- 送信 (動作確認用のクライアント) ---
+def submit(url, seed, mode, inputs, claimed):
+    body = json.dumps({"seed": seed, "mode": mode, "inputs": base64.b64encode(inputs).decode(), "claimed": claimed}).encode()
+    request = urllib.request.Request(url.rstrip("/") + "/submit", body, {"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=VERIFY_TIMEOUT) as response: return response.status, json.load(response)
+    except urllib.error.HTTPError as e: return e.code, json.load(e)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="送られたプレイを画面なしで再生し直してスコアを検証する localhost 専用サーバー")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--queue", type=int, default=64, help="処理中の他に待たせておける件数 (超えたら 503)")
+    parser.add_argument("--cache", type=int, default=4096, help="覚えておく検証結果の件数")
+    parser.add_argument("--submit", metavar="REPLAY", help="サーバーを立てずに、リプレイファイルを送って結果を表示する")
+    parser.add_argument("--result", choices=(tg.STATE_GAME_OVER, tg.STATE_CLEAR)); parser.add_argument("--height", type=int); parser.add_argument("--survival", type=float)
+    args = parser.parse_args(argv)
+
+    if args.submit:
+        if args.result is None or args.height is None: parser.error("--submit には --result と --height が必要です")
+        seed, mode, inputs = tg.read_replay(args.submit)
+        claimed = {key: value for key, value in (("result", args.result), ("height", args.height), ("survival_time", args.survival)) if value is not None}
+        status, payload = submit(f"http://{HOST}:{args.port}", seed, mode, inputs, claimed)
+        print(status, json.dumps(payload, ensure_ascii=False, indent=2))
+        return 0 if status == 200 and payload.get("valid") else 1
+
+    server, verifier = serve(args.port, args.workers, args.queue, args.cache)
+    print(f"http://{HOST}:{args.port} で待ち受けています (ワーカー {verifier.workers}、受付枠 {verifier.capacity})")
+    try: server.serve_forever()
+    except KeyboardInterrupt: pass
+    finally: server.server_close(); verifier.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
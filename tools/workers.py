@@ -0,0 +1,17 @@
+"""ツールのプロセスプール (ProcessPoolExecutor) のワーカー側で共有する状態
+
+    ProcessPoolExecutor(max_workers=n, initializer=workers.init_worker)
+"""
+import tsunami_game as tg
+
+_POOL = None  # ワーカープロセスごとに 1 つのオブジェクトプールを使い回す
+
+def init_worker():
+    """ワーカープロセスの起動時に 1 回だけ呼ばれる"""
+    global _POOL
+    _POOL = tg.ObjectPool(tg.SpriteAtlas())
+
+def object_pool():
+    """このプロセスのオブジェクトプール (initializer を通さずに呼ばれた場合もここで作る)"""
+    if _POOL is None: init_worker()
+    return _POOL
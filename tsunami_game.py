@@ -4,6 +4,16 @@ import random
 import math
 import os
 import asyncio
+import io
+import heapq
+import struct
+import time
+import json
+import csv
+from array import array
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+import importlib
 
 # --- 初期設定 ---
 SCREEN_WIDTH = 1280
@@ -16,18 +26,495 @@ GREEN = (0, 255, 0); BLUE = (0, 0, 255); GRAY = (128, 128, 128); GOLD = (255, 21
 
 # --- ゲームの状態 ---
 STATE_TITLE = "title"; STATE_PLAYING = "playing"; STATE_RULES = "rules"; STATE_ACHIEVEMENTS = "achievements"
-STATE_GAME_OVER = "game_over"; STATE_CLEAR = "clear"
+STATE_GAME_OVER = "game_over"; STATE_CLEAR = "clear"; STATE_REPLAY = "replay"
+
+# --- テキスト描画キャッシュ ---
+class TextCache:
+    """(text, font, color, antialias) をキーにした描画済みテキストの LRU キャッシュ"""
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0; self.misses = 0; self.evictions = 0
+        self.antialias = True  # False にすると全テキストをアンチエイリアスなしで描く (品質ガバナー用)
+
+    def render(self, text, font, color, antialias=True):
+        antialias = antialias and self.antialias
+        key = (text, font, tuple(color), antialias)
+        surface = self.entries.get(key)
+        if surface is not None:
+            self.hits += 1; self.entries.move_to_end(key)
+            return surface
+        self.misses += 1
+        surface = font.render(text, antialias, color)
+        self.entries[key] = surface
+        if len(self.entries) > self.max_entries: self.entries.popitem(last=False); self.evictions += 1
+        return surface
+
+    def clear(self):
+        self.entries.clear(); self.hits = 0; self.misses = 0; self.evictions = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses, "evictions": self.evictions, "hit_rate": self.hits / total if total else 0.0}
+
+TEXT_CACHE = TextCache()
+
+def align_rect(rect, x, y, align):
+    if align == "center": rect.center = (x, y)
+    elif align == "topleft": rect.topleft = (x, y)
+    elif align == "topright": rect.topright = (x, y)
+    return rect
 
 # --- テキスト描画関数 ---
-def draw_text(screen, text, font, color, x, y, align="center"):
-    text_surface = font.render(text, True, color)
-    text_rect = text_surface.get_rect()
-    if align == "center": text_rect.center = (x, y)
-    elif align == "topleft": text_rect.topleft = (x, y)
-    elif align == "topright": text_rect.topright = (x, y)
+def draw_text(screen, text, font, color, x, y, align="center", antialias=True):
+    text_surface = TEXT_CACHE.render(text, font, color, antialias)
+    text_rect = align_rect(text_surface.get_rect(), x, y, align)
     screen.blit(text_surface, text_rect)
+    return text_rect
+
+# --- HUD ラベル (値が変わったときだけ再描画) ---
+class HudLabel:
+    def __init__(self, fmt, font, color, x, y, align="center"):
+        self.fmt, self.font, self.color = fmt, font, color
+        self.x, self.y, self.align = x, y, align
+        self.value = None; self.surface = None; self.rect = None; self.antialias = None
+        self.renders = 0
+
+    def layout(self, value, antialias=True):
+        antialias = antialias and TEXT_CACHE.antialias
+        if self.surface is None or value != self.value or antialias != self.antialias:
+            # 頻繁に変わる値で LRU を汚さないよう、キャッシュを通さず直接描画する
+            self.value = value; self.antialias = antialias; self.renders += 1
+            self.surface = self.font.render(self.fmt.format(value), antialias, self.color)
+            self.rect = align_rect(self.surface.get_rect(), self.x, self.y, self.align)
+        return self.rect
+
+    def draw(self, screen, value, antialias=True):
+        rect = self.layout(value, antialias); screen.blit(self.surface, rect)
+        return rect
+
+# --- 保持モードのメニュー描画 ---
+class MenuRenderer:
+    """メニュー画面をキャッシュ面に一度だけ描き、無効化された領域だけを画面へ送る"""
+    def __init__(self, size=(SCREEN_WIDTH, SCREEN_HEIGHT)):
+        self.size = size
+        self.surface = None
+        self.bg_color = BLACK
+        self.widgets = OrderedDict()  # name -> (rect, draw関数)
+        self.dirty = []; self.full_redraw = True; self.overlay_rect = None
+        self.presents = 0; self.idle_frames = 0
+
+    def reset(self, bg_color=BLACK):
+        """画面遷移時に呼ぶ。ウィジェットを捨てて次の present で全面を描き直す"""
+        self.bg_color = bg_color; self.widgets.clear()
+        self.dirty = []; self.full_redraw = True
+
+    def add(self, name, rect, draw):
+        if name in self.widgets: self.dirty.append(self.widgets[name][0])
+        rect = pygame.Rect(rect); self.widgets[name] = (rect, draw); self.dirty.append(rect)
+
+    def remove(self, name):
+        entry = self.widgets.pop(name, None)
+        if entry: self.dirty.append(entry[0])
+
+    def invalidate(self, name=None):
+        if name is None: self.full_redraw = True
+        elif name in self.widgets: self.dirty.append(self.widgets[name][0])
+
+    def add_button(self, name, rect, color, text, font, text_color=WHITE):
+        rect = pygame.Rect(rect)
+        def draw(surface):
+            pygame.draw.rect(surface, color, rect); draw_text(surface, text, font, text_color, rect.centerx, rect.centery)
+        self.add(name, rect, draw)
+
+    def add_text(self, name, text, font, color, x, y, align="center", box=None):
+        """text に関数を渡すと描画のたびに文字列を評価する (box で再描画領域を固定する)"""
+        get_text = text if callable(text) else (lambda: text)
+        if box is None: box = align_rect(TEXT_CACHE.render(get_text(), font, color).get_rect(), x, y, align)
+        self.add(name, box, lambda surface: draw_text(surface, get_text(), font, color, x, y, align))
+
+    def _paint(self, area):
+        self.surface.set_clip(area); self.surface.fill(self.bg_color, area)
+        for rect, draw in self.widgets.values():
+            if area is None or rect.colliderect(area): draw(self.surface)
+        self.surface.set_clip(None)
+
+    def present(self, screen, overlay=None):
+        """変化がなければ何もしない。戻り値は画面へ送った矩形のリスト。
+        overlay(screen) を渡すとキャッシュの上に毎フレーム重ねて描く (戻り値はその矩形)"""
+        if self.surface is None or self.surface.get_size() != screen.get_size():
+            self.surface = pygame.Surface(screen.get_size()).convert(); self.full_redraw = True
+        if self.overlay_rect is not None:
+            # 前フレームのオーバーレイの下を描き直す (閉じられた場合もこれで消える)
+            self.dirty.append(self.overlay_rect); self.overlay_rect = None
+        if self.full_redraw:
+            self._paint(None); screen.blit(self.surface, (0, 0))
+            if overlay: self.overlay_rect = overlay(screen)
+            pygame.display.flip()
+            self.full_redraw = False; self.dirty = []; self.presents += 1
+            return [screen.get_rect()]
+        if not self.dirty and not overlay:
+            self.idle_frames += 1
+            return []
+        rects = [rect.clip(screen.get_rect()) for rect in self.dirty]; self.dirty = []
+        for rect in rects:
+            self._paint(rect); screen.blit(self.surface, rect, rect)
+        if overlay: self.overlay_rect = overlay(screen); rects.append(self.overlay_rect)
+        pygame.display.update(rects); self.presents += 1
+        return rects
+
+# --- ダーティ矩形描画 (play_game 用) ---
+class DirtyRectRenderer:
+    """前フレームからの変化を追跡し、変わった領域だけを描き直して display.update で送る。
+    カメラが動いたフレームや変化が大きいフレームは全面描画の方が安いので flip に切り替える"""
+    def __init__(self, full_redraw_ratio=0.5):
+        self.enabled = False
+        self.full_redraw_ratio = full_redraw_ratio
+        self.tracked = {}  # key -> (rect, state)
+        self.seen = set(); self.dirty = []; self.force_full = True
+        self.last_pixels_pushed = 0; self.total_pixels_pushed = 0
+        self.frames = 0; self.full_frames = 0
+
+    def reset(self):
+        self.tracked.clear(); self.seen.clear(); self.dirty = []; self.force_full = True
+
+    def invalidate_all(self):
+        self.force_full = True
+
+    def track(self, key, rect, state=None, sweep=False):
+        """sweep=True の場合は旧矩形と新矩形の間も含めて無効化する (津波の前線など)"""
+        rect = pygame.Rect(rect); self.seen.add(key)
+        prev = self.tracked.get(key)
+        if prev is None: self.dirty.append(rect)
+        elif prev[0] != rect or prev[1] != state:
+            if sweep: self.dirty.append(prev[0].union(rect))
+            else: self.dirty.append(prev[0]); self.dirty.append(rect)
+        self.tracked[key] = (rect, state)
+
+    def _collect_dirty(self, screen_rect):
+        for key in [key for key in self.tracked if key not in self.seen]: self.dirty.append(self.tracked.pop(key)[0])
+        self.seen = set()
+        merged = []
+        for rect in self.dirty:
+            rect = rect.clip(screen_rect)
+            if rect.width <= 0 or rect.height <= 0: continue
+            i = rect.collidelist(merged)
+            while i != -1: rect.union_ip(merged.pop(i)); i = rect.collidelist(merged)
+            merged.append(rect)
+        self.dirty = []
+        return merged
+
+    def present(self, screen, paint, overlay=None):
+        """paint(area) は area (None なら全面) に限定して場面を描く関数。
+        overlay(screen) は全部の矩形を描き終えてから 1 回だけ重ねる (下の場面は track で登録した矩形として描き直される)"""
+        screen_rect = screen.get_rect(); rects = self._collect_dirty(screen_rect)
+        area = sum(rect.width * rect.height for rect in rects)
+        self.frames += 1
+        if self.force_full or area > screen_rect.width * screen_rect.height * self.full_redraw_ratio:
+            paint(None)
+            if overlay: overlay(screen)
+            pygame.display.flip(); self.force_full = False
+            self.full_frames += 1; self.last_pixels_pushed = screen_rect.width * screen_rect.height
+        else:
+            for rect in rects: paint(rect)
+            if overlay: rects.append(overlay(screen))
+            if rects: pygame.display.update(rects)
+            self.last_pixels_pushed = area
+        self.total_pixels_pushed += self.last_pixels_pushed
+        return rects
+
+# --- フレームプロファイラ ---
+PROFILE_PHASES = ("idle", "events", "input", "player", "tsunami", "stream", "collide", "respawn", "draw", "flip")
+PROFILE_DIR = "profiles"
+OVERLAY_GRAPH_WIDTH = 240; OVERLAY_GRAPH_HEIGHT = 60; OVERLAY_MS_SCALE = 2  # 縦 1px = 0.5ms
+
+class FrameProfiler:
+    """フェーズごとの所要時間をフレーム単位で固定長のリングバッファに記録する。
+    mark(phase) は直前の mark からの経過時間を phase に足すだけなので、1 フレーム数マイクロ秒で済む"""
+    def __init__(self, capacity=600, phases=PROFILE_PHASES):
+        self.capacity = capacity; self.phases = phases
+        self.phase_index = {phase: i for i, phase in enumerate(phases)}
+        self.stride = len(phases) + 2  # 開始時刻, フレーム時間, 各フェーズ
+        self.data = array("d", bytes(8 * capacity * self.stride))
+        self.frames = 0; self.row = None; self.last = 0.0
+        self.overlay = False; self.overlay_surface = None; self.overlay_lines = []; self.extra_lines = []
+        self.extra_stats = {}  # 名前 -> stats() を返す関数 (JSON の書き出しに含める)
+
+    def frame(self):
+        """ループの先頭で呼ぶ。前のフレームを確定し、次のフレームの行を空にする"""
+        now = time.perf_counter(); data = self.data
+        if self.row is not None: data[self.row + 1] = now - data[self.row]; self.frames += 1
+        self.row = row = (self.frames % self.capacity) * self.stride
+        data[row] = now
+        for i in range(row + 1, row + self.stride): data[i] = 0.0
+        self.last = now
+
+    def mark(self, phase):
+        """直前の mark (またはフレーム開始) からの時間を phase に加える"""
+        if self.row is None: return
+        now = time.perf_counter(); self.data[self.row + 2 + self.phase_index[phase]] += now - self.last; self.last = now
+
+    def reset(self):
+        self.frames = 0; self.row = None
+
+    def recent(self):
+        """記録済みのフレームを古い順に (開始時刻, フレーム時間, {phase: 秒}) で返す"""
+        count = min(self.frames, self.capacity); first = self.frames - count; data = self.data; rows = []
+        for n in range(first, self.frames):
+            row = (n % self.capacity) * self.stride
+            rows.append((data[row], data[row + 1], {phase: data[row + 2 + i] for i, phase in enumerate(self.phases)}))
+        return rows
+
+    def stats(self):
+        frames = self.recent()
+        if not frames: return {"frames": 0}
+        times = sorted(frame[1] for frame in frames)
+        def pct(q): return times[min(len(times) - 1, int(q * len(times)))] * 1000
+        busy = {phase: sum(frame[2][phase] for frame in frames) / len(frames) * 1000 for phase in self.phases if phase != "idle"}
+        worst = max(frames, key=lambda frame: frame[1])
+        return {
+            "frames": len(frames), "p50_ms": pct(0.5), "p95_ms": pct(0.95), "p99_ms": pct(0.99), "max_ms": times[-1] * 1000,
+            "mean_phase_ms": busy, "worst_frame_ms": worst[1] * 1000,
+            "worst_frame_phases_ms": {phase: value * 1000 for phase, value in worst[2].items() if phase != "idle"},
+        }
+
+    # --- オーバーレイ ---
+    def overlay_rect(self):
+        return pygame.Rect(10, 150, OVERLAY_GRAPH_WIDTH + 20, OVERLAY_GRAPH_HEIGHT + 30 + 24 * (4 + len(self.extra_lines)))
+
+    def draw_overlay(self, screen, font):
+        """フレーム時間のグラフと統計を描く。統計の文字は 30 フレームに 1 回だけ作り直す"""
+        rect = self.overlay_rect()
+        if self.overlay_surface is None or self.overlay_surface.get_size() != rect.size:
+            self.overlay_surface = pygame.Surface(rect.size); self.overlay_surface.set_alpha(210)
+        surface = self.overlay_surface; surface.fill((20, 20, 30))
+        graph_bottom = 10 + OVERLAY_GRAPH_HEIGHT; budget_y = graph_bottom - int(1000 / FPS * OVERLAY_MS_SCALE)
+        count = min(self.frames, self.capacity, OVERLAY_GRAPH_WIDTH); data = self.data
+        for x in range(count):
+            row = ((self.frames - count + x) % self.capacity) * self.stride
+            busy = data[row + 1] - data[row + 2 + self.phase_index["idle"]]
+            height = min(OVERLAY_GRAPH_HEIGHT, int(busy * 1000 * OVERLAY_MS_SCALE))
+            pygame.draw.line(surface, RED if data[row + 1] * 1000 > 1000 / FPS * 1.5 else GREEN, (10 + x, graph_bottom), (10 + x, graph_bottom - height))
+        pygame.draw.line(surface, GOLD, (10, budget_y), (10 + OVERLAY_GRAPH_WIDTH, budget_y))
+        if self.frames % 30 == 0 or not self.overlay_lines:
+            stats = self.stats()
+            if stats["frames"]:
+                worst = sorted(stats["worst_frame_phases_ms"].items(), key=lambda item: -item[1])[:3]
+                top = max(stats["mean_phase_ms"].items(), key=lambda item: item[1])
+                lines = [f"p50 {stats['p50_ms']:.1f}  p95 {stats['p95_ms']:.1f}  p99 {stats['p99_ms']:.1f} ms",
+                         f"max {stats['max_ms']:.1f} ms  重い: {top[0]} {top[1]:.2f} ms",
+                         "最悪: " + " ".join(f"{phase} {ms:.1f}" for phase, ms in worst),
+                         "F3: 閉じる  F4: 書き出し"]
+            else: lines = ["計測中..."]
+            lines += [line() for line in self.extra_lines]
+            self.overlay_lines = [font.render(line, True, WHITE) for line in lines]
+        for i, text in enumerate(self.overlay_lines): surface.blit(text, (10, graph_bottom + 10 + i * 24))
+        screen.blit(surface, rect)
+        return rect
+
+    # --- 書き出し ---
+    def export_json(self, path):
+        frames = [{"start": start, "frame_ms": total * 1000, "phases_ms": {phase: value * 1000 for phase, value in phases.items()}} for start, total, phases in self.recent()]
+        with open(path, "w") as f: json.dump({"stats": self.stats(), **{name: stats() for name, stats in self.extra_stats.items()}, "frames": frames}, f, ensure_ascii=False, indent=1)
+
+    def export_csv(self, path):
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f); writer.writerow(["start", "frame_ms"] + [f"{phase}_ms" for phase in self.phases])
+            for start, total, phases in self.recent(): writer.writerow([f"{start:.6f}", f"{total * 1000:.3f}"] + [f"{phases[phase] * 1000:.3f}" for phase in self.phases])
+
+    def export_chrome_trace(self, path):
+        """chrome://tracing / Perfetto で開ける形式。フェーズは複数回に分かれていてもフレーム内で 1 本にまとめて並べる"""
+        events = []
+        for n, (start, total, phases) in enumerate(self.recent()):
+            ts = start * 1e6
+            events.append({"name": "frame", "ph": "X", "ts": ts, "dur": total * 1e6, "pid": 1, "tid": 1, "args": {"frame": n}})
+            for phase in self.phases:
+                if phases[phase] <= 0: continue
+                events.append({"name": phase, "ph": "X", "ts": ts, "dur": phases[phase] * 1e6, "pid": 1, "tid": 2}); ts += phases[phase] * 1e6
+        with open(path, "w") as f: json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    def export(self, directory=PROFILE_DIR):
+        """JSON / CSV / Chrome トレースをまとめて書き出し、書き出したパスのリストを返す"""
+        os.makedirs(directory, exist_ok=True); stamp = time.strftime("%Y%m%d_%H%M%S")
+        base = os.path.join(directory, f"profile_{stamp}")
+        self.export_json(base + ".json"); self.export_csv(base + ".csv"); self.export_chrome_trace(base + ".trace.json")
+        return [base + ".json", base + ".csv", base + ".trace.json"]
 
-# --- プレイヤークラス (タッチ操作対応) ---
+# --- 品質ガバナー ---
+# 下の段ほど軽い。各段は上の段の設定を引き継いで 1 つずつ削る
+QUALITY_TIERS = (
+    {"name": "最高", "antialias": True, "wave_effects": True, "render_scale": 1, "fps": 60},
+    {"name": "文字AAなし", "antialias": False, "wave_effects": True, "render_scale": 1, "fps": 60},
+    {"name": "波の演出なし", "antialias": False, "wave_effects": False, "render_scale": 1, "fps": 60},
+    {"name": "半分の解像度", "antialias": False, "wave_effects": False, "render_scale": 2, "fps": 60},
+    {"name": "30Hz", "antialias": False, "wave_effects": False, "render_scale": 2, "fps": 30},
+)
+GOVERNOR_WINDOW = 60  # 判定に使う直近のフレーム数
+GOVERNOR_DOWN_RATIO = 1.15  # フレーム時間の 90 パーセンタイルが予算のこの倍を超えたら 1 段下げる
+GOVERNOR_UP_RATIO = 0.6  # 実働時間の 90 パーセンタイルが上の段の予算のこの倍に収まっていたら 1 段上げる
+GOVERNOR_DOWN_HOLD_MS = 1000; GOVERNOR_UP_HOLD_MS = 5000; GOVERNOR_MAX_UP_HOLD_MS = 60000
+
+class QualityGovernor:
+    """clock.tick のフレーム時間の分布を見て描画品質の段を上げ下げする。
+    下げる判定は待ちを含むフレーム時間 (予算を守れたか)、上げる判定は待ちを除いた実働時間 (余裕があるか) で行い、
+    両者の閾値の差と段を変えた後の待ち時間でヒステリシスを持たせる。上げてすぐ下がった場合は次に上げるまでの待ちを倍にする"""
+    def __init__(self, tiers=QUALITY_TIERS, window=GOVERNOR_WINDOW):
+        self.tiers = tiers; self.tier = 0; self.enabled = True
+        self.frame_ms = deque(maxlen=window); self.busy_ms = deque(maxlen=window)
+        self.last_change = 0; self.last_step_up = False; self.up_hold = GOVERNOR_UP_HOLD_MS
+        self.changes = 0
+
+    def settings(self):
+        return self.tiers[self.tier]
+
+    def fps(self, cap):
+        """clock.tick に渡すフレームレート (cap が 0 なら上限なしのまま)"""
+        return min(cap, self.settings()["fps"]) if cap else cap
+
+    @staticmethod
+    def p90(samples):
+        return sorted(samples)[int(len(samples) * 0.9)]
+
+    def sample(self, frame_ms, busy_ms, now):
+        """clock.tick の戻り値と clock.get_rawtime() を記録する。段を変えたら True"""
+        self.frame_ms.append(frame_ms); self.busy_ms.append(busy_ms)
+        if not self.enabled or len(self.frame_ms) < self.frame_ms.maxlen: return False
+        since = now - self.last_change
+        if self.tier + 1 < len(self.tiers) and since >= GOVERNOR_DOWN_HOLD_MS and self.p90(self.frame_ms) > 1000 / self.settings()["fps"] * GOVERNOR_DOWN_RATIO:
+            if self.last_step_up and since < self.up_hold: self.up_hold = min(self.up_hold * 2, GOVERNOR_MAX_UP_HOLD_MS)
+            return self.set_tier(self.tier + 1, now)
+        if self.tier > 0 and since >= self.up_hold and self.p90(self.busy_ms) < 1000 / self.tiers[self.tier - 1]["fps"] * GOVERNOR_UP_RATIO:
+            return self.set_tier(self.tier - 1, now)
+        return False
+
+    def set_tier(self, tier, now=0):
+        self.last_step_up = tier < self.tier; self.tier = tier; self.last_change = now; self.changes += 1
+        self.frame_ms.clear(); self.busy_ms.clear()
+        return True
+
+    def stats(self):
+        return {"tier": self.tier, "name": self.settings()["name"], "changes": self.changes, "up_hold_ms": self.up_hold, "enabled": self.enabled}
+
+# --- 入力ビット (1 ティック分の移動入力を 1 バイトで表す) ---
+INPUT_UP = 1; INPUT_DOWN = 2; INPUT_LEFT = 4; INPUT_RIGHT = 8
+
+# --- 受け取るイベント (それ以外は SDL のキューに積ませない) ---
+# キーとマウスボタンの状態は SDL が内部で更新するので、KEYUP・MOUSEMOTION などを止めても get_pressed / get_pos は使える
+# WINDOWEXPOSED は隠れていた窓が再び見えたときに届く。メニューは変化した部分しか描かないので、これを受けて全体を描き直す
+ALLOWED_EVENTS = (pygame.QUIT, pygame.KEYDOWN, pygame.MOUSEBUTTONDOWN, pygame.FINGERDOWN, pygame.FINGERMOTION, pygame.FINGERUP,
+                  pygame.WINDOWFOCUSLOST, pygame.WINDOWEXPOSED)
+
+def install_event_filter():
+    pygame.event.set_blocked(None); pygame.event.set_allowed(ALLOWED_EVENTS)
+
+# --- 仮想スティック (マルチタッチ / マウス) ---
+STICK_RADIUS = 90  # 中心からこれだけ動かすと最大入力 (px)
+STICK_KNOB_RADIUS = 30
+STICK_DEADZONE = 0.25  # 半径に対する割合。これ未満は入力なし
+STICK_DIAGONAL = 0.414  # tan(22.5°)。8 方向に分ける境界
+
+class TouchStick:
+    """触れた位置を中心にするアナログスティック。最初に触れた指で操作し、2 本目以降の指は控えとして追跡して、
+    操作中の指が離れたら次に古い指がその場所を中心に引き継ぐ。指がないときはマウスのドラッグを同じように扱う
+    (タッチから合成されたマウス入力は指がある間は無視される)"""
+    def __init__(self):
+        self.fingers = OrderedDict()  # (touch_id, finger_id) -> [中心, 現在位置]
+        self.mouse = None  # マウスで操作中なら [中心, 現在位置]
+
+    def reset(self):
+        self.fingers.clear(); self.mouse = None
+
+    def handle_event(self, event):
+        """指のイベントなら状態を更新して True を返す"""
+        if event.type == pygame.WINDOWFOCUSLOST: self.reset(); return False
+        if event.type not in (pygame.FINGERDOWN, pygame.FINGERMOTION, pygame.FINGERUP): return False
+        key = (event.touch_id, event.finger_id); pos = (event.x * SCREEN_WIDTH, event.y * SCREEN_HEIGHT)
+        if event.type == pygame.FINGERUP:
+            was_active = self.fingers and next(iter(self.fingers)) == key
+            self.fingers.pop(key, None)
+            if was_active and self.fingers: pointer = next(iter(self.fingers.values())); pointer[0] = pointer[1]
+        elif key in self.fingers: self.fingers[key][1] = pos
+        else: self.fingers[key] = [pos, pos]  # 別の画面で押された指は最初の移動から追跡する
+        return True
+
+    def pointer(self):
+        """操作中の [中心, 現在位置] (なければ None)。マウスはここで状態を読む"""
+        if self.fingers: self.mouse = None; return next(iter(self.fingers.values()))
+        if not pygame.mouse.get_pressed()[0]: self.mouse = None; return None
+        pos = pygame.mouse.get_pos()
+        if self.mouse is None: self.mouse = [pos, pos]
+        else: self.mouse[1] = pos
+        return self.mouse
+
+    def vector(self):
+        """中心からのずれを半径で割った (x, y)。長さは 1 まで"""
+        pointer = self.pointer()
+        if pointer is None: return 0.0, 0.0
+        (cx, cy), (x, y) = pointer; dx = (x - cx) / STICK_RADIUS; dy = (y - cy) / STICK_RADIUS
+        length = math.hypot(dx, dy)
+        return (dx / length, dy / length) if length > 1 else (dx, dy)
+
+    def read(self):
+        """スティックの向きを 8 方向の INPUT_* にする (シミュレーションとリプレイは 1 バイトのビット入力のまま)"""
+        x, y = self.vector(); inputs = 0
+        if math.hypot(x, y) < STICK_DEADZONE: return 0
+        if abs(y) > abs(x) * STICK_DIAGONAL: inputs |= INPUT_UP if y < 0 else INPUT_DOWN
+        if abs(x) > abs(y) * STICK_DIAGONAL: inputs |= INPUT_LEFT if x < 0 else INPUT_RIGHT
+        return inputs
+
+    def rect(self):
+        """描画範囲 (操作中でなければ None)。ダーティ矩形の登録用"""
+        pointer = self.fingers and next(iter(self.fingers.values())) or self.mouse
+        if pointer is None: return None
+        size = 2 * (STICK_RADIUS + STICK_KNOB_RADIUS)
+        return pygame.Rect(0, 0, size, size).move(pointer[0][0] - size // 2, pointer[0][1] - size // 2)
+
+    def draw(self, screen):
+        pointer = self.fingers and next(iter(self.fingers.values())) or self.mouse
+        if pointer is None: return
+        x, y = self.vector(); center = pointer[0]
+        pygame.draw.circle(screen, GRAY, center, STICK_RADIUS, 3)
+        pygame.draw.circle(screen, WHITE, (center[0] + x * STICK_RADIUS, center[1] + y * STICK_RADIUS), STICK_KNOB_RADIUS)
+
+# --- 入力から表示までの遅延 ---
+class InputLatency:
+    """入力 (INPUT_* のビット和) が変わってから、その入力で進めたティックを flip し終えるまでの時間 (ms)。
+    pygame のイベントにも get_pressed にも発生時刻はないので、変化は「前回イベントを取り出した時刻」から
+    「今回取り出した時刻」までの間に起きたとみなす。
+    p50/p95/max は前回取り出した時刻から測る (OS・SDL のキューと clock.tick の待ちで遅れた分を最大に見積もった上限)。
+    sample_to_flip は今回取り出した時刻から測る (読み取ってからティックを進めて表示するまでの下限)"""
+    def __init__(self, capacity=240):
+        self.samples = deque(maxlen=capacity); self.after_poll = deque(maxlen=capacity); self.count = 0
+        self.last_inputs = 0; self.pending = None; self.applied = False
+        self.last_poll = None; self.window = None
+
+    def reset(self):
+        """シーンに入ったとき。メニューにいた間はイベントを取り出した時刻に数えない"""
+        self.last_poll = None; self.pending = None; self.applied = False
+
+    def poll(self, now):
+        """pygame.event.get の直前に呼ぶ。キーの状態もこのとき SDL の中で更新される"""
+        self.window = (now if self.last_poll is None else self.last_poll, now); self.last_poll = now
+
+    def sample(self, inputs):
+        if inputs != self.last_inputs and self.pending is None and self.window is not None: self.pending = self.window; self.applied = False
+        self.last_inputs = inputs
+
+    def stepped(self):
+        if self.pending is not None: self.applied = True
+
+    def presented(self, now):
+        if not self.applied: return
+        since, polled = self.pending
+        self.samples.append(now - since); self.after_poll.append(now - polled); self.count += 1; self.pending = None; self.applied = False
+
+    def stats(self):
+        values = sorted(self.samples); after = sorted(self.after_poll)
+        if not values: return {"count": self.count, "p50_ms": 0.0, "p95_ms": 0.0, "max_ms": 0.0, "sample_to_flip_p50_ms": 0.0}
+        return {"count": self.count, "p50_ms": values[len(values) // 2], "p95_ms": values[min(len(values) - 1, int(0.95 * len(values)))], "max_ms": values[-1],
+                "sample_to_flip_p50_ms": after[len(after) // 2]}
+
+# --- プレイヤークラス ---
 class Player(pygame.sprite.Sprite):
     def __init__(self):
         super().__init__()
@@ -36,27 +523,16 @@ class Player(pygame.sprite.Sprite):
         self.world_x, self.world_y = 0, 0
         self.stamina, self.max_stamina = 100, 100
         self.base_speed, self.height = 5, 0
-        
-        self.moving_up = False
-        self.moving_down = False
-        self.moving_left = False
-        self.moving_right = False
-
-    def update(self):
-        keys = pygame.key.get_pressed()
-        
-        kb_up = keys[pygame.K_w]
-        kb_down = keys[pygame.K_s]
-        kb_left = keys[pygame.K_a]
-        kb_right = keys[pygame.K_d]
 
+    def update(self, inputs=0):
+        """inputs は INPUT_* のビット和 (キーボードやタッチの読み取りは呼び出し側で行う)"""
         move_y = 0
-        if kb_up or self.moving_up: move_y -= 1
-        if kb_down or self.moving_down: move_y += 1
+        if inputs & INPUT_UP: move_y -= 1
+        if inputs & INPUT_DOWN: move_y += 1
             
         move_x = 0
-        if kb_left or self.moving_left: move_x -= 1
-        if kb_right or self.moving_right: move_x += 1
+        if inputs & INPUT_LEFT: move_x -= 1
+        if inputs & INPUT_RIGHT: move_x += 1
 
         current_speed = self.base_speed * (self.stamina / self.max_stamina)
         if current_speed < self.base_speed / 3: current_speed = self.base_speed / 3
@@ -74,56 +550,1015 @@ class Player(pygame.sprite.Sprite):
             self.stamina += 0.2
             if self.stamina > self.max_stamina: self.stamina = self.max_stamina
 
-        self.moving_up = False
-        self.moving_down = False
-        self.moving_left = False
-        self.moving_right = False
+# --- 津波クラス ---
+WAVE_CREST_HEIGHT = 24; WAVE_TILE_WIDTH = 160; WAVE_FRAME_COUNT = 8
+WAVE_SCROLL_SPEED = 2; WAVE_FRAME_TICKS = 6
+LIGHT_BLUE = (90, 160, 255); FOAM = (220, 235, 255)
+
+def build_wave_frames():
+    """波頭のタイル (横に継ぎ目なく並ぶ) を数フレーム分だけ事前に生成する"""
+    frames = []
+    for f in range(WAVE_FRAME_COUNT):
+        frame = pygame.Surface((WAVE_TILE_WIDTH, WAVE_CREST_HEIGHT), pygame.SRCALPHA)
+        phase = 2 * math.pi * f / WAVE_FRAME_COUNT
+        for x in range(WAVE_TILE_WIDTH):
+            t = 2 * math.pi * x / WAVE_TILE_WIDTH
+            crest = (WAVE_CREST_HEIGHT - 4) * (0.5 + 0.3 * math.sin(t + phase) + 0.2 * math.sin(2 * t - phase))
+            top = int(WAVE_CREST_HEIGHT - 2 - crest)
+            pygame.draw.line(frame, LIGHT_BLUE, (x, top), (x, WAVE_CREST_HEIGHT - 1))
+            pygame.draw.line(frame, FOAM, (x, top), (x, min(top + 2, WAVE_CREST_HEIGHT - 1)))
+        if pygame.display.get_surface() is not None: frame = frame.convert_alpha()
+        frames.append(frame)
+    return frames
 
-# --- 津波クラス (変更なし) ---
 class Tsunami(pygame.sprite.Sprite):
-    def __init__(self, player_base_speed):
+    wave_frames = None  # 全インスタンスで共有
+
+    def __init__(self, player_base_speed, rng=random, now=0, target_range=(100, 1000)):
         super().__init__()
-        self.image = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT * 2)); self.image.fill(BLUE)
-        self.target_height = random.randint(100, 1000)
+        # 画面外まで含めた巨大な面は持たず、見えている帯だけを毎フレーム塗る
+        self.rect = pygame.Rect(0, SCREEN_HEIGHT, SCREEN_WIDTH, SCREEN_HEIGHT * 2)
+        self.target_height = rng.randint(*target_range)
         self.world_y = SCREEN_HEIGHT / 2
-        self.rect = self.image.get_rect(topleft=(0, SCREEN_HEIGHT))
         self.base_speed = player_base_speed / 3; self.speed = self.base_speed
         self.speed_multiplier = 1.3; self.speed_up_interval = 20 * 1000
-        self.last_speed_up = pygame.time.get_ticks()
+        self.last_speed_up = now
+        self.wave_effects = True; self.anim_ticks = 0
 
-    def update(self, player_world_y):
-        now = pygame.time.get_ticks()
+    def update(self, player_world_y, now):
+        """now はシミュレーション時刻 (ミリ秒)"""
         if now - self.last_speed_up > self.speed_up_interval:
             self.speed *= self.speed_multiplier; self.last_speed_up = now
         self.world_y -= self.speed
         self.rect.y = (self.world_y - player_world_y) + (SCREEN_HEIGHT / 2)
+        self.anim_ticks += 1
+
+    def crest_rect(self, top=None):
+        if top is None: top = self.rect.y
+        if not self.wave_effects: return pygame.Rect(0, top, SCREEN_WIDTH, 1)
+        return pygame.Rect(0, top - WAVE_CREST_HEIGHT, SCREEN_WIDTH, WAVE_CREST_HEIGHT + 1)
+
+    def anim_state(self):
+        if not self.wave_effects: return None
+        return (self.anim_ticks // WAVE_FRAME_TICKS) % WAVE_FRAME_COUNT, (self.anim_ticks * WAVE_SCROLL_SPEED) % WAVE_TILE_WIDTH
+
+    def draw(self, screen, top=None):
+        """画面内に見えている部分 (top から画面下端まで) だけを塗り、波頭のタイルを重ねる。
+        top は補間済みの描画位置 (省略時は rect.y)"""
+        if top is None: top = self.rect.y
+        visible = pygame.Rect(0, top, SCREEN_WIDTH, self.rect.height).clip(screen.get_rect())
+        if visible.height > 0: screen.fill(BLUE, visible)
+        if not self.wave_effects or not (0 < top <= screen.get_height() + WAVE_CREST_HEIGHT): return
+        if Tsunami.wave_frames is None: Tsunami.wave_frames = build_wave_frames()
+        frame_index, offset = self.anim_state()
+        frame = Tsunami.wave_frames[frame_index]; y = top - WAVE_CREST_HEIGHT
+        for x in range(-offset, screen.get_width(), WAVE_TILE_WIDTH): screen.blit(frame, (x, y))
 
     def slow_down(self):
         if self.speed > self.base_speed: self.speed /= self.speed_multiplier
 
-# --- アイテム/障害物クラス (変更なし) ---
+# --- アイテム/障害物の種類 ---
+OBJECT_TYPES = {
+    "glass": {"size": (15, 15), "color": GRAY, "shape": "rect"},
+    "blue_orb": {"size": (25, 25), "color": BLUE, "shape": "circle"},
+    "green_orb": {"size": (25, 25), "color": GREEN, "shape": "circle"},
+    "stairs": {"size": (40, 40), "color": WHITE, "shape": "rect"},
+}
+
+# --- 1 チャンクあたりの平均個数 (小数部は確率で 1 個増やす) と、取られてから同じ場所に戻るまでの遅延 (ミリ秒) ---
+# 個数は以前の上限 (プレイヤーの周り 1600x1600 px、約 10 チャンクにガラス 20・青 1・緑 3・階段 10) をチャンクあたりに割ったもの。
+# 以前もハードモードで変えていたのは遅延とガラスのダメージだけなので、個数は両モードで同じにする (難しさを二重に上げない)
+BASE_CHUNK_DENSITY = {"glass": 2.0, "blue_orb": 0.1, "green_orb": 0.3, "stairs": 1.0}
+CHUNK_DENSITY = {"normal": BASE_CHUNK_DENSITY, "hard": BASE_CHUNK_DENSITY}
+RESPAWN_DELAYS = {
+    "normal": {"glass": 1000, "blue_orb": 1667, "green_orb": 1667, "stairs": 1667},
+    "hard": {"glass": 500, "blue_orb": 5000, "green_orb": 5000, "stairs": 5000},
+}
+GLASS_DAMAGE = {"normal": 30, "hard": 60}
+
+# --- バランス調整用のパラメータ (Simulation の params で上書きできる) ---
+SIM_PARAMS = {
+    "target_height_min": 100, "target_height_max": 1000,
+    "speed_multiplier": 1.3, "speed_up_interval": 20 * 1000,
+    "stair_height_gain": 10, "green_orb_stamina": 20, "height_gain_interval": 10000,
+}
+
+def sim_params(mode="normal", overrides=None):
+    """モードの既定値に overrides を重ねる。respawn_delays / chunk_density は種類ごとに部分的に上書きできる"""
+    params = dict(SIM_PARAMS, glass_damage=GLASS_DAMAGE[mode], respawn_delays=dict(RESPAWN_DELAYS[mode]), chunk_density=dict(CHUNK_DENSITY[mode]))
+    for key, value in (overrides or {}).items():
+        if key not in params: raise KeyError(f"未知のパラメータ: {key}")
+        if isinstance(params[key], dict): params[key].update(value)
+        else: params[key] = value
+    return params
+
+# --- 再出現スケジューラ ---
+class RespawnScheduler:
+    """取られたオブジェクトを元の場所へ戻す時刻をキーにしたヒープで管理し、毎ティック期限の来たものだけを取り出す"""
+    def __init__(self, delays=RESPAWN_DELAYS["normal"]):
+        self.delays = dict(delays)
+        self.live = {obj_type: 0 for obj_type in self.delays}
+        self.heap = []; self.seq = 0
+        self.scheduled = 0; self.spawned = 0
+
+    def added(self, obj_type): self.live[obj_type] += 1
+    def removed(self, obj_type): self.live[obj_type] -= 1
+
+    def schedule(self, now, obj_type, slot):
+        # 同時刻のものは登録順に出す (seq がないと slot の比較になってしまう)
+        heapq.heappush(self.heap, (now + self.delays[obj_type], self.seq, obj_type, slot))
+        self.seq += 1; self.scheduled += 1
+
+    def due(self, now):
+        """期限の来た (obj_type, slot) を順に返す"""
+        heap = self.heap
+        while heap and heap[0][0] <= now:
+            _, _, obj_type, slot = heapq.heappop(heap)
+            self.spawned += 1; yield obj_type, slot
+
+    def stats(self):
+        return {"queued": len(self.heap), "scheduled": self.scheduled, "spawned": self.spawned, "live": dict(self.live)}
+
+# --- 共有スプライト画像 ---
+class SpriteAtlas:
+    """種類ごとに一枚だけ画面形式へ変換済みの画像を作り、全インスタンスで共有する"""
+    def __init__(self, object_types=OBJECT_TYPES):
+        self.object_types = object_types
+        self.images = {}
+        self.surfaces_created = 0
+
+    def get(self, obj_type):
+        image = self.images.get(obj_type)
+        if image is None:
+            image = self.images[obj_type] = self.build(obj_type)
+        return image
+
+    def build(self, obj_type):
+        spec = self.object_types[obj_type]; w, h = spec["size"]
+        image = pygame.Surface((w, h)); self.surfaces_created += 1
+        if spec["shape"] == "circle":
+            # 透明部分はカラーキーで抜く (ピクセル単位のアルファより速い)
+            image.fill(BLACK); pygame.draw.circle(image, spec["color"], (w // 2, h // 2), min(w, h) // 2)
+            image.set_colorkey(BLACK, pygame.RLEACCEL)
+        else: image.fill(spec["color"])
+        if pygame.display.get_surface() is not None: image = image.convert()
+        return image
+
+# --- アイテム/障害物クラス ---
 class WorldObject(pygame.sprite.Sprite):
-    def __init__(self, obj_type, image, size, player_world_pos):
+    def __init__(self, obj_type, image, world_x=0, world_y=0):
         super().__init__()
         self.type = obj_type
-        self.image = pygame.Surface(size, pygame.SRCALPHA); self.image.blit(image, (0,0))
-        spawn_range = 800
-        self.world_x = player_world_pos[0] + random.randint(-spawn_range, spawn_range)
-        self.world_y = player_world_pos[1] + random.randint(-spawn_range, spawn_range)
+        self.image = image
         self.rect = self.image.get_rect()
+        self.world_x, self.world_y = world_x, world_y
+        self.cell = None  # 置き場の中での位置 (SpatialHash ではセル、ObjectArrays では配列の添字)
+        self.chunk = None; self.index = None  # チャンク内での生成順 (取られた後の復活に使う)
 
     def update(self, player_world_x, player_world_y):
         self.rect.centerx = self.world_x - player_world_x + SCREEN_WIDTH / 2
         self.rect.centery = self.world_y - player_world_y + SCREEN_HEIGHT / 2
-        return not (-100 < self.rect.centerx < SCREEN_WIDTH + 100 and -100 < self.rect.centery < SCREEN_HEIGHT + 100)
+
+# --- オブジェクトプール ---
+class ObjectPool:
+    """破棄したチャンクの/取得された WorldObject を捨てずに再利用する"""
+    def __init__(self, atlas):
+        self.atlas = atlas
+        self.free = {obj_type: [] for obj_type in atlas.object_types}
+        self.objects_created = 0; self.objects_reused = 0
+
+    def acquire(self, obj_type, world_x, world_y):
+        free = self.free[obj_type]
+        if free:
+            obj = free.pop(); obj.world_x, obj.world_y = world_x, world_y; self.objects_reused += 1
+            return obj
+        self.objects_created += 1
+        return WorldObject(obj_type, self.atlas.get(obj_type), world_x, world_y)
+
+    def release(self, obj):
+        obj.kill(); self.free[obj.type].append(obj)
+
+# --- チャンク単位のワールド生成 ---
+CHUNK_SIZE = 512
+CHUNK_PRELOAD = CHUNK_SIZE // 2  # 保持範囲のこれだけ外側に掛かるチャンクまで先に生成しておく
+CHUNK_EVICT = CHUNK_SIZE  # 保持範囲からこれ以上離れたチャンクを捨てる (境界を行き来しても生成と破棄を繰り返さない)
+MASK64 = (1 << 64) - 1
+
+def mix64(z):
+    """splitmix64 の仕上げ関数"""
+    z = (z + 0x9E3779B97F4A7C15) & MASK64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK64
+    return z ^ (z >> 31)
+
+def chunk_seed(seed, cx, cy):
+    """(seed, cx, cy) のハッシュ。Python の hash() と違って環境によらず同じ値になる"""
+    return mix64(mix64(mix64(seed & MASK64) ^ (cx & MASK64)) ^ (cy & MASK64))
+
+def chunk_range(left, top, right, bottom):
+    """ワールド矩形と重なるチャンクの範囲 (cx0, cy0, cx1, cy1)"""
+    return int(left // CHUNK_SIZE), int(top // CHUNK_SIZE), int(right // CHUNK_SIZE), int(bottom // CHUNK_SIZE)
+
+def generate_chunk(seed, cx, cy, density):
+    """チャンクの中身 [(obj_type, world_x, world_y), ...]。同じ引数からは常に同じ並びになる"""
+    rng = random.Random(chunk_seed(seed, cx, cy)); x0, y0 = cx * CHUNK_SIZE, cy * CHUNK_SIZE; contents = []
+    for obj_type in OBJECT_TYPES:
+        mean = density.get(obj_type, 0); count = int(mean) + (rng.random() < mean - int(mean))
+        for _ in range(count): contents.append((obj_type, x0 + rng.randrange(CHUNK_SIZE), y0 + rng.randrange(CHUNK_SIZE)))
+    return contents
+
+# --- 空間ハッシュ ---
+SPATIAL_CELL_SIZE = 128; CULL_MARGIN = 100
+MAX_OBJECT_SIZE = max(max(spec["size"]) for spec in OBJECT_TYPES.values())
+
+class SpatialHash:
+    """ワールド座標を固定サイズのセルに分けて WorldObject を登録し、範囲の問い合わせをセル単位で行う。
+    セルの中身は挿入順を保つ dict なので、問い合わせ結果の順序は実行ごとに変わらない"""
+    name = "sprite"
+
+    @staticmethod
+    def available(): return True
+
+    def __init__(self, cell_size=SPATIAL_CELL_SIZE):
+        self.cell_size = cell_size
+        self.clear()
+
+    def clear(self):
+        self.cells = {}  # (cx, cy) -> {obj: None}
+        self.count = 0
+
+    def cell_of(self, x, y):
+        return int(x // self.cell_size), int(y // self.cell_size)
+
+    def outer_range(self, left, top, right, bottom):
+        """矩形と重なるセルの範囲 (cx0, cy0, cx1, cy1)"""
+        (cx0, cy0), (cx1, cy1) = self.cell_of(left, top), self.cell_of(right, bottom)
+        return cx0, cy0, cx1, cy1
+
+    def insert(self, obj):
+        obj.cell = self.cell_of(obj.world_x, obj.world_y)
+        self.cells.setdefault(obj.cell, {})[obj] = None; self.count += 1
+
+    def remove(self, obj):
+        bucket = self.cells.get(obj.cell)
+        if bucket is None or obj not in bucket: return
+        del bucket[obj]; self.count -= 1
+        if not bucket: del self.cells[obj.cell]
+        obj.cell = None
+
+    def move(self, obj):
+        """world_x / world_y を変えた後に呼ぶ"""
+        if self.cell_of(obj.world_x, obj.world_y) != obj.cell: self.remove(obj); self.insert(obj)
+
+    def _buckets(self, cx0, cy0, cx1, cy1):
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(self.cells):
+            # 範囲が広すぎるときは埋まっているセルだけを走査する
+            for (cx, cy), bucket in self.cells.items():
+                if cx0 <= cx <= cx1 and cy0 <= cy <= cy1: yield (cx, cy), bucket
+            return
+        cells = self.cells
+        for cy in range(cy0, cy1 + 1):
+            for cx in range(cx0, cx1 + 1):
+                bucket = cells.get((cx, cy))
+                if bucket: yield (cx, cy), bucket
+
+    def candidates(self, left, top, right, bottom):
+        """ワールド矩形と重なりうるもの (中心が矩形の MAX_OBJECT_SIZE / 2 外側までにあるセルの中身。正確な判定はしない)"""
+        margin = MAX_OBJECT_SIZE / 2; found = []
+        for _, bucket in self._buckets(*self.outer_range(left - margin, top - margin, right + margin, bottom + margin)): found.extend(bucket)
+        return found
+
+    def query(self, left, top, right, bottom):
+        """ワールド矩形と重なるもの (ObjectArrays.query と同じ判定)"""
+        hits = []
+        for obj in self.candidates(left, top, right, bottom):
+            x, y = obj.world_x, obj.world_y; half_w, half_h = obj.rect.width / 2, obj.rect.height / 2
+            if x + half_w > left and x - half_w < right and y + half_h > top and y - half_h < bottom: hits.append(obj)
+        return hits
+
+    def colliding(self, rect, px, py):
+        """カメラを (px, py) に置いたときに画面座標の rect と重なるもの。返したものの rect は画面座標に更新済み"""
+        left = px + rect.left - SCREEN_WIDTH / 2 - MAX_OBJECT_SIZE; top = py + rect.top - SCREEN_HEIGHT / 2 - MAX_OBJECT_SIZE
+        hits = []
+        for obj in self.candidates(left, top, left + rect.width + 2 * MAX_OBJECT_SIZE, top + rect.height + 2 * MAX_OBJECT_SIZE):
+            obj.update(px, py)
+            if obj.rect.colliderect(rect): hits.append(obj)
+        return hits
+
+    def ordered(self):
+        """登録されている全オブジェクト (セルごと、セル内は登録順)"""
+        return [obj for bucket in self.cells.values() for obj in bucket]
+
+# --- 構造体配列版のオブジェクト置き場 (numpy がある場合のみ) ---
+np = None; _numpy_checked = False
+
+def load_numpy():
+    """numpy を初めて必要になったときに読み込む (無い環境とブラウザ版では None)。
+    起動時には読まず、import 文も書かないので pygbag はブラウザ版の依存パッケージとして取り込まない"""
+    global np, _numpy_checked
+    if not _numpy_checked and sys.platform != "emscripten":
+        try: np = importlib.import_module("numpy")
+        except ImportError: pass
+    _numpy_checked = True
+    return np
+
+class ObjectArrays:
+    """SpatialHash と同じように使える置き場。全オブジェクトの種類・ワールド座標・大きさ・生存フラグを
+    連続した numpy 配列に持ち、画面座標への変換・画面外の除外・矩形の重なり判定をそれぞれ配列全体への
+    1 回の演算で済ませる。Python で触るのは当たったもの/見えているものだけなので、数千個でも重くならない。
+    途中の配列は作り置きの作業用配列に out= で書き込み、毎フレームの判定では新しい配列を作らない"""
+    name = "numpy"
+
+    @staticmethod
+    def available(): return load_numpy() is not None
+
+    def __init__(self, capacity=256):
+        if load_numpy() is None: raise RuntimeError("numpy がないため配列版のオブジェクト置き場は使えません")
+        self.kinds = {obj_type: i for i, obj_type in enumerate(OBJECT_TYPES)}
+        self.x = np.zeros(capacity); self.y = np.zeros(capacity)
+        self.w = np.zeros(capacity, np.int32); self.h = np.zeros(capacity, np.int32)
+        self.kind = np.zeros(capacity, np.int8); self.alive = np.zeros(capacity, bool)
+        self.objects = [None] * capacity
+        self._make_scratch(capacity)
+        self.clear()
+
+    def _make_scratch(self, capacity):
+        self.scratch = [np.zeros(capacity) for _ in range(3)]; self.masks = [np.zeros(capacity, bool) for _ in range(2)]
+
+    def clear(self):
+        self.alive[:] = False; self.objects = [None] * len(self.objects)
+        self.free = []; self.high = 0; self.count = 0  # free は空いた添字のヒープ (小さい方から詰める)
+
+    def _grow(self):
+        for name in ("x", "y", "w", "h", "kind", "alive"):
+            arr = getattr(self, name); setattr(self, name, np.concatenate([arr, np.zeros_like(arr)]))
+        self.objects += [None] * len(self.objects); self._make_scratch(len(self.objects))
+
+    def insert(self, obj):
+        if self.free: slot = heapq.heappop(self.free)
+        else:
+            slot = self.high; self.high += 1
+            if slot == len(self.objects): self._grow()
+        w, h = obj.rect.size
+        self.x[slot] = obj.world_x; self.y[slot] = obj.world_y; self.w[slot] = w; self.h[slot] = h
+        self.kind[slot] = self.kinds[obj.type]; self.alive[slot] = True
+        self.objects[slot] = obj; obj.cell = slot; self.count += 1
+
+    def remove(self, obj):
+        slot = obj.cell
+        if slot is None or self.objects[slot] is not obj: return
+        self.alive[slot] = False; self.objects[slot] = None; heapq.heappush(self.free, slot)
+        obj.cell = None; self.count -= 1
+
+    def move(self, obj):
+        """world_x / world_y を変えた後に呼ぶ"""
+        self.x[obj.cell] = obj.world_x; self.y[obj.cell] = obj.world_y
+
+    def _pick(self, mask):
+        objects = self.objects
+        return [objects[slot] for slot in np.flatnonzero(mask)]
+
+    def query(self, left, top, right, bottom):
+        """ワールド矩形と重なるもの"""
+        n = self.high; half, edge = self.scratch[0][:n], self.scratch[1][:n]; mask, test = self.masks[0][:n], self.masks[1][:n]
+        np.copyto(mask, self.alive[:n])
+        for pos, size, low, high in ((self.x[:n], self.w[:n], left, right), (self.y[:n], self.h[:n], top, bottom)):
+            np.multiply(size, 0.5, out=half)
+            np.add(pos, half, out=edge); np.greater(edge, low, out=test); mask &= test
+            np.subtract(pos, half, out=edge); np.less(edge, high, out=test); mask &= test
+        return self._pick(mask)
+
+    def colliding(self, rect, px, py):
+        """カメラを (px, py) に置いたときに画面座標の rect と重なるもの。返したものの rect は画面座標に更新済み"""
+        n = self.high; left, top, work = (a[:n] for a in self.scratch); mask, test = self.masks[0][:n], self.masks[1][:n]
+        np.copyto(mask, self.alive[:n])
+        # WorldObject.update と同じ丸め (Rect への代入は 0.5 を 0 から遠い方へ丸める) で左上の画面座標を出す
+        for corner, pos, size, cam, half_screen, low, high in ((left, self.x[:n], self.w[:n], px, SCREEN_WIDTH / 2, rect.left, rect.right),
+                                                               (top, self.y[:n], self.h[:n], py, SCREEN_HEIGHT / 2, rect.top, rect.bottom)):
+            np.subtract(pos, cam, out=corner); corner += half_screen
+            np.copysign(0.5, corner, out=work); corner += work; np.trunc(corner, out=corner)
+            np.floor_divide(size, 2, out=work); corner -= work
+            np.less(corner, high, out=test); mask &= test
+            np.add(corner, size, out=work); np.greater(work, low, out=test); mask &= test
+        slots = np.flatnonzero(mask)
+        objects = self.objects; hits = []
+        for slot, x, y in zip(slots.tolist(), left[slots].astype(int).tolist(), top[slots].astype(int).tolist()):
+            obj = objects[slot]; obj.rect.topleft = (x, y); hits.append(obj)
+        return hits
+
+    def ordered(self):
+        """登録されている全オブジェクト (添字順)"""
+        return self._pick(self.alive[:self.high])
+
+OBJECT_STORES = {"sprite": SpatialHash, "numpy": ObjectArrays}
+
+def available_stores():
+    """今の環境で使えるオブジェクト置き場の名前 (numpy はここで初めて読み込まれる)"""
+    return [name for name, store in OBJECT_STORES.items() if store.available()]
+
+# --- シミュレーション本体 (描画なし) ---
+TICK_RATE = 60
+
+class Simulation:
+    """プレイヤー・津波・オブジェクト・再出現・当たり判定・勝敗をティック単位で進める。
+    乱数は seed から作った専用の Random、時計はティック数、入力は step() に渡すビット列だけなので、
+    同じ seed と入力列からは常に同じ結果になり、画面なしで実時間より速く回せる"""
+    def __init__(self, seed=0, mode="normal", atlas=None, pool=None, params=None, store="sprite"):
+        self.seed = seed; self.mode = mode
+        self.rng = random.Random(seed)
+        self.sprite_atlas = atlas or SpriteAtlas(); self.object_pool = pool or ObjectPool(self.sprite_atlas)
+        self.params = params = sim_params(mode, params)
+        self.glass_damage = params["glass_damage"]
+        self.ticks = 0; self.state = STATE_PLAYING; self.profiler = None
+        self.final_survival_time = 0.0; self.final_height = 0
+        self.player = Player(); self.tsunami = Tsunami(self.player.base_speed, self.rng, target_range=(params["target_height_min"], params["target_height_max"]))
+        self.tsunami.speed_multiplier = params["speed_multiplier"]; self.tsunami.speed_up_interval = params["speed_up_interval"]
+        self.last_height_gain = 0
+        self.type_order = {obj_type: i for i, obj_type in enumerate(OBJECT_TYPES)}
+        self.object_grid = OBJECT_STORES[store](); self.density = params["chunk_density"]
+        self.chunks = {}  # (cx, cy) -> {index: WorldObject}
+        self.chunk_range = None; self.chunks_generated = 0
+        self.taken = set()  # 取られて再出現待ちの (chunk, index)。チャンクを作り直しても出さない
+        self.respawns = RespawnScheduler(params["respawn_delays"])
+        self.stream_chunks()
+
+    def time_ms(self):
+        return self.ticks * 1000 // TICK_RATE
+
+    def spawn_object(self, obj_type, world_x, world_y, chunk, index):
+        obj = self.object_pool.acquire(obj_type, world_x, world_y); obj.chunk, obj.index = chunk, index
+        self.chunks[chunk][index] = obj; self.object_grid.insert(obj); self.respawns.added(obj_type)
+        return obj
+
+    def despawn_object(self, obj):
+        del self.chunks[obj.chunk][obj.index]
+        self.object_grid.remove(obj); self.respawns.removed(obj.type); self.object_pool.release(obj)
+
+    def load_chunk(self, chunk):
+        self.chunks[chunk] = {}; self.chunks_generated += 1
+        for index, (obj_type, world_x, world_y) in enumerate(generate_chunk(self.seed, *chunk, self.density)):
+            if (chunk, index) not in self.taken: self.spawn_object(obj_type, world_x, world_y, chunk, index)
+
+    def unload_chunk(self, chunk):
+        for obj in list(self.chunks[chunk].values()): self.despawn_object(obj)
+        del self.chunks[chunk]
+
+    def close(self):
+        """全チャンクを捨てて、オブジェクトを共有プールへ返す。シミュレーションを差し替える前に呼ぶ (何度呼んでもよい)"""
+        for chunk in list(self.chunks): self.unload_chunk(chunk)
+        self.chunk_range = None
+
+    def switch_store(self, store):
+        """オブジェクト置き場を OBJECT_STORES[store] に入れ替える (中身は並び順を保って移す)"""
+        if store == self.object_grid.name: return
+        objects = self.object_grid.ordered(); self.object_grid = OBJECT_STORES[store]()
+        for obj in objects: self.object_grid.insert(obj)
+
+    def keep_rect(self):
+        """画面とその周囲 CULL_MARGIN の範囲 (ワールド座標の left, top, right, bottom)"""
+        px, py = self.player.world_x, self.player.world_y
+        return (px - SCREEN_WIDTH / 2 - CULL_MARGIN, py - SCREEN_HEIGHT / 2 - CULL_MARGIN, px + SCREEN_WIDTH / 2 + CULL_MARGIN, py + SCREEN_HEIGHT / 2 + CULL_MARGIN)
+
+    def stream_chunks(self):
+        """保持範囲の周りのチャンクを生成し、離れたチャンクを捨てる。
+        範囲がチャンクの境界をまたいだティックだけ働くので、どれだけ遠く/速く移動しても 1 ティックの仕事量は一定"""
+        left, top, right, bottom = self.keep_rect()
+        pre = CHUNK_PRELOAD; wanted = chunk_range(left - pre, top - pre, right + pre, bottom + pre)
+        if wanted == self.chunk_range: return
+        self.chunk_range = wanted
+        ev = CHUNK_EVICT; x0, y0, x1, y1 = chunk_range(left - ev, top - ev, right + ev, bottom + ev)
+        for chunk in [chunk for chunk in self.chunks if not (x0 <= chunk[0] <= x1 and y0 <= chunk[1] <= y1)]: self.unload_chunk(chunk)
+        cx0, cy0, cx1, cy1 = wanted
+        for cy in range(cy0, cy1 + 1):
+            for cx in range(cx0, cx1 + 1):
+                if (cx, cy) not in self.chunks: self.load_chunk((cx, cy))
+
+    def colliding_objects(self):
+        """プレイヤーと重なったものを OBJECT_TYPES の順に返す"""
+        player = self.player
+        hits = self.object_grid.colliding(player.rect, player.world_x, player.world_y)
+        hits.sort(key=lambda obj: self.type_order[obj.type])
+        return hits
+
+    def step(self, inputs=0):
+        """1 ティック進める。戻り値はこのティックで起きたイベント ("damage" / "item") のリスト"""
+        if self.state != STATE_PLAYING: return []
+        self.ticks += 1; now = self.time_ms(); events = []
+        player, tsunami, prof = self.player, self.tsunami, self.profiler
+        player.update(inputs)
+        if prof: prof.mark("player")
+        tsunami.update(player.world_y, now)
+        if prof: prof.mark("tsunami")
+        
+        self.stream_chunks()
+        if prof: prof.mark("stream")
+        
+        for hit in self.colliding_objects():
+            self.respawns.schedule(now, hit.type, (hit.chunk, hit.index, hit.world_x, hit.world_y))
+            self.taken.add((hit.chunk, hit.index)); self.despawn_object(hit)
+            if hit.type == "glass": events.append("damage"); player.stamina -= self.glass_damage; continue
+            events.append("item")
+            if hit.type == "blue_orb": tsunami.slow_down()
+            elif hit.type == "green_orb": player.stamina += self.params["green_orb_stamina"]
+            elif hit.type == "stairs": player.height += self.params["stair_height_gain"]
+        if prof: prof.mark("collide")
+        
+        for obj_type, (chunk, index, world_x, world_y) in self.respawns.due(now):
+            # チャンクが捨てられていれば、次に生成されたときに元の場所に出る
+            self.taken.discard((chunk, index))
+            if chunk in self.chunks: self.spawn_object(obj_type, world_x, world_y, chunk, index)
+        
+        if now - self.last_height_gain > self.params["height_gain_interval"]: player.height += 1; self.last_height_gain = now
+        if player.rect.bottom >= tsunami.rect.y: self.finish(STATE_GAME_OVER, now)
+        elif player.height >= tsunami.target_height: self.finish(STATE_CLEAR, now)
+        if prof: prof.mark("respawn")
+        return events
+
+    def finish(self, state, now):
+        self.state = state; self.final_survival_time = now / 1000; self.final_height = self.player.height
+
+    def snapshot(self):
+        """状態を描画用オブジェクトを含まない素のデータとして取り出す。
+        置き場の中の並びも保存するので、restore 後の問い合わせ順 (= 以後の展開) も元と一致する"""
+        player, tsunami, respawns = self.player, self.tsunami, self.respawns
+        objects = [(obj.type, obj.world_x, obj.world_y, obj.chunk, obj.index) for obj in self.object_grid.ordered()]
+        return {
+            "ticks": self.ticks, "state": self.state, "final": (self.final_survival_time, self.final_height),
+            "last_height_gain": self.last_height_gain, "rng": self.rng.getstate(),
+            "player": (player.world_x, player.world_y, player.stamina, player.height),
+            "tsunami": (tsunami.target_height, tsunami.world_y, tsunami.speed, tsunami.last_speed_up, tsunami.anim_ticks, tsunami.rect.y),
+            "objects": objects, "chunks": list(self.chunks), "chunk_range": self.chunk_range, "taken": sorted(self.taken),
+            "respawns": (list(respawns.heap), respawns.seq, respawns.scheduled, respawns.spawned),
+        }
+
+    def restore(self, snap):
+        """snapshot() の結果に戻す。player / tsunami は同じインスタンスのまま値だけを書き換える"""
+        player, tsunami, respawns = self.player, self.tsunami, self.respawns
+        self.ticks, self.state = snap["ticks"], snap["state"]
+        self.final_survival_time, self.final_height = snap["final"]
+        self.last_height_gain = snap["last_height_gain"]; self.rng.setstate(snap["rng"])
+        player.world_x, player.world_y, player.stamina, player.height = snap["player"]
+        tsunami.target_height, tsunami.world_y, tsunami.speed, tsunami.last_speed_up, tsunami.anim_ticks, tsunami.rect.y = snap["tsunami"]
+        for chunk in list(self.chunks): self.unload_chunk(chunk)
+        self.object_grid.clear()
+        self.chunks = {chunk: {} for chunk in snap["chunks"]}; self.chunk_range = snap["chunk_range"]; self.taken = set(snap["taken"])
+        heap, respawns.seq, respawns.scheduled, respawns.spawned = snap["respawns"]
+        respawns.heap = list(heap)
+        for obj_type, world_x, world_y, chunk, index in snap["objects"]: self.spawn_object(obj_type, world_x, world_y, chunk, index)
+
+    def run(self, inputs, max_ticks=None):
+        """入力列 (1 ティック 1 要素) を終わるまで流す。勝敗がついた時点で止まる"""
+        for bits in inputs:
+            if self.state != STATE_PLAYING or (max_ticks is not None and self.ticks >= max_ticks): break
+            self.step(bits)
+        return self.state
+
+# --- 固定ステップ ---
+MAX_CATCHUP_STEPS = 5
+
+class FixedStepper:
+    """経過した実時間を貯め、固定長のティックに切り出す。1 フレームで進めるティック数には上限を設け、
+    超えた分は捨てる (重いフレームが続いても追いつこうとして更に重くなる悪循環を防ぐ)"""
+    def __init__(self, tick_rate=TICK_RATE, max_steps=MAX_CATCHUP_STEPS):
+        self.step_ms = 1000 / tick_rate; self.max_steps = max_steps
+        self.accumulator = 0.0; self.dropped_ms = 0.0
+
+    def reset(self):
+        self.accumulator = 0.0
+
+    def advance(self, elapsed_ms):
+        """このフレームで進めるティック数を返す"""
+        self.accumulator += elapsed_ms
+        steps = int(self.accumulator // self.step_ms); self.accumulator -= steps * self.step_ms
+        if steps > self.max_steps: self.dropped_ms += (steps - self.max_steps) * self.step_ms; steps = self.max_steps
+        return steps
+
+    def alpha(self):
+        """直前の 2 状態の間のどこを描くか (0.0 - 1.0)"""
+        return min(1.0, self.accumulator / self.step_ms)
+
+# --- リプレイ (ヘッダー + 1 ティック 1 バイトの入力列) ---
+REPLAY_MAGIC = b"TSRP"; REPLAY_VERSION = 3  # 2: ワールドをチャンク単位で生成するようになった 3: ハードモードの個数を通常と同じにした
+REPLAY_HEADER = struct.Struct("<4sBBIH")  # magic, version, mode, seed, tick_rate
+REPLAY_MODES = ("normal", "hard")
+REPLAY_FLUSH_TICKS = TICK_RATE  # 異常終了しても失うのは最大 1 秒分
+REPLAY_SNAPSHOT_INTERVAL = 10 * TICK_RATE
+REPLAY_DIR = "replays"; LAST_REPLAY = os.path.join(REPLAY_DIR, "last.tsr")
+
+class ReplayWriter:
+    """プレイ中の入力をファイルへ逐次書き出す (60 ティック/秒 なら 1 分で約 3.6KB)"""
+    def __init__(self, path, seed, mode):
+        directory = os.path.dirname(path)
+        if directory: os.makedirs(directory, exist_ok=True)
+        self.path = path; self.file = open(path, "wb"); self.ticks = 0
+        self.file.write(REPLAY_HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION, REPLAY_MODES.index(mode), seed, TICK_RATE))
+
+    def record(self, inputs):
+        self.file.write(bytes((inputs,))); self.ticks += 1
+        if self.ticks % REPLAY_FLUSH_TICKS == 0: self.file.flush()
+
+    def close(self):
+        if not self.file.closed: self.file.close()
+
+def read_replay(path):
+    """(seed, mode, inputs) を返す。inputs は 1 ティック 1 バイトの bytes"""
+    with open(path, "rb") as f: data = f.read()
+    if len(data) < REPLAY_HEADER.size: raise ValueError(f"リプレイが短すぎます: {path}")
+    magic, version, mode, seed, tick_rate = REPLAY_HEADER.unpack_from(data)
+    if magic != REPLAY_MAGIC or version != REPLAY_VERSION: raise ValueError(f"リプレイ形式が違います: {path}")
+    if tick_rate != TICK_RATE: raise ValueError(f"ティックレートが違います ({tick_rate} != {TICK_RATE}): {path}")
+    return seed, REPLAY_MODES[mode], data[REPLAY_HEADER.size:]
+
+class ReplayPlayer:
+    """リプレイを Simulation で 1 ティックずつ再現する。再生中に一定間隔でスナップショットを取り、
+    seek は目的のティック以前で最も近いスナップショットから進める"""
+    def __init__(self, path, atlas=None, pool=None, snapshot_interval=REPLAY_SNAPSHOT_INTERVAL):
+        self.seed, self.mode, self.inputs = read_replay(path)
+        self.sim = Simulation(self.seed, self.mode, atlas, pool)
+        self.snapshot_interval = snapshot_interval; self.snapshots = {0: self.sim.snapshot()}
+
+    def done(self):
+        return self.sim.state != STATE_PLAYING or self.sim.ticks >= len(self.inputs)
+
+    def step(self):
+        if self.done(): return []
+        events = self.sim.step(self.inputs[self.sim.ticks])
+        if self.sim.ticks % self.snapshot_interval == 0 and self.sim.ticks not in self.snapshots: self.snapshots[self.sim.ticks] = self.sim.snapshot()
+        return events
+
+    def seek(self, tick):
+        tick = max(0, min(tick, len(self.inputs)))
+        base = max(t for t in self.snapshots if t <= tick)
+        if not (base <= self.sim.ticks <= tick): self.sim.restore(self.snapshots[base])
+        while self.sim.ticks < tick and not self.done(): self.step()
+
+    def run_headless(self):
+        """最後まで最高速で再生し、Simulation を返す"""
+        while not self.done(): self.step()
+        return self.sim
+
+# --- 実績の条件 (Game.check_achievements とスコアの検証で共有する) ---
+# (key, 必要な生存秒数, クリア時に必要な高さ, 通知文)。どちらか一方だけを使う
+ACHIEVEMENT_RULES = {
+    "normal": (
+        ("survived_1_min", 60, None, "実績解除: 1分間 生存する"), ("survived_3_min", 180, None, "実績解除: 3分間 生存する"),
+        ("cleared_300m", None, 300, "実績解除: 高さ300mをクリア"), ("cleared_800m", None, 800, "実績解除: 高さ800mをクリア"),
+    ),
+    "hard": (
+        ("hm_survived_2_min", 120, None, "実績解除: ハード 2分間生存"), ("hm_survived_4_min", 240, None, "実績解除: ハード 4分間生存"),
+        ("hm_cleared_500m", None, 500, "実績解除: ハード 高さ500mクリア"), ("hm_cleared_1000m", None, 1000, "実績解除: ハード 高さ1000mクリア"),
+    ),
+}
+
+def earned_achievements(mode, state, survival_time, height):
+    """終わったゲームの結果から、条件を満たした実績の (key, 通知文) を返す"""
+    earned = []
+    for key, min_time, min_height, message in ACHIEVEMENT_RULES[mode]:
+        if (survival_time >= min_time) if min_height is None else (state == STATE_CLEAR and height >= min_height): earned.append((key, message))
+    return earned
+
+def verify_run(seed, mode, inputs, pool=None):
+    """入力列を画面なしで再生し、play_game / check_achievements と同じ手順で結果を出す。
+    入力が尽きても勝敗がついていなければ result は "incomplete" になる"""
+    sim = Simulation(seed, mode, pool=pool); sim.run(inputs); sim.close()
+    result = sim.state if sim.state != STATE_PLAYING else "incomplete"
+    return {"result": result, "ticks": sim.ticks, "height": sim.final_height, "survival_time": sim.final_survival_time,
+            "achievements": [key for key, _ in earned_achievements(mode, sim.state, sim.final_survival_time, sim.final_height)] if result != "incomplete" else []}
+
+# --- 起動時間の計測 ---
+class StartupReport:
+    """起動の各段階の所要時間 (ミリ秒) を記録する。最初のフレームを出した時点で一度だけ表示し、
+    それ以降に初めて使われて初期化されたサブシステムは「遅延」として別に記録する"""
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.stages = []; self.lazy_stages = []  # (name, ms)
+        self.first_frame_ms = None
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try: yield
+        finally:
+            ms = (time.perf_counter() - start) * 1000
+            if self.first_frame_ms is None: self.stages.append((name, ms))
+            else: self.lazy_stages.append((name, ms)); print(f"起動後に初期化: {name} {ms:.1f} ms")
+
+    def first_frame(self):
+        if self.first_frame_ms is not None: return
+        self.first_frame_ms = (time.perf_counter() - self.origin) * 1000
+        print(self.format())
+
+    def report(self):
+        return {"stages_ms": dict(self.stages), "first_frame_ms": self.first_frame_ms, "lazy_ms": dict(self.lazy_stages)}
+
+    def format(self):
+        lines = ["--- 起動時間 ---"] + [f"{name:>12}: {ms:7.1f} ms" for name, ms in self.stages]
+        if self.first_frame_ms is not None: lines.append(f"{'最初のフレーム':>12}: {self.first_frame_ms:7.1f} ms")
+        lines += [f"{name + ' (遅延)':>12}: {ms:7.1f} ms" for name, ms in self.lazy_stages]
+        return "\n".join(lines)
+
+# --- アセット管理 ---
+SOUND_DIR = "sounds"
+SFX_FILES = {"get_item": "get_item.wav", "damage": "damage.wav", "game_over": "game_over.wav", "clear": "clear.wav"}
+BGM_FILES = {"lobby": "Lobby.wav", "normal": "ordinary.wav", "hard": "difficult.wav"}
+
+class AssetManager:
+    """フォント・効果音・BGM を asyncio のループ上で 1 フレームに 1 つずつ読み込む。
+    同じ (種類, パス, 引数) の要求は 1 つの Future にまとめ、読み込んだものは共有キャッシュに残す。
+    ブラウザにはスレッドがないので、重い処理はループに制御を返しながら順番に進める"""
+    def __init__(self):
+        self.cache = {}  # key -> 読み込んだアセット (失敗したものは None)
+        self.futures = {}  # key -> Future
+        self.queue = None; self.worker = None
+        self.requested = 0; self.completed = 0; self.failed = {}
+
+    @staticmethod
+    def load(kind, path, *args):
+        if kind == "font": return pygame.font.Font(path, *args)
+        if kind == "sound": return pygame.mixer.Sound(path)  # 全体をデコードしてミキサーの形式 (MIXER_SETTINGS) に変換しておく
+        if kind == "music":
+            # music.load はファイルからストリーム再生するので、中身だけ先にメモリへ読んでおく
+            with open(path, "rb") as f: return f.read()
+        raise ValueError(f"未知のアセットの種類: {kind}")
+
+    def _store(self, key, load):
+        try: asset = load(*key)
+        except (pygame.error, OSError) as e:
+            print(f"★ アセットの読み込みに失敗しました {key[1]}: {e}"); self.failed[key] = str(e); asset = None
+        self.cache[key] = asset
+        return asset
+
+    def load_now(self, kind, path, *args):
+        """同期的に読み込む (最初のフレームに必要なもの用)。キャッシュ済みならそれを返す"""
+        key = (kind, path) + args
+        if key in self.cache: return self.cache[key]
+        return self._store(key, self.load)
+
+    def get(self, kind, path, *args):
+        """読み込み済みなら返す。まだなら None"""
+        return self.cache.get((kind, path) + args)
+
+    def request(self, kind, path, *args):
+        """読み込みを予約して Future を返す。同じ要求は同じ Future を共有する"""
+        key = (kind, path) + args
+        future = self.futures.get(key)
+        if future is not None: return future
+        loop = asyncio.get_event_loop(); future = self.futures[key] = loop.create_future()
+        if key in self.cache: future.set_result(self.cache[key]); return future
+        if self.queue is None: self.queue = asyncio.Queue(); self.worker = loop.create_task(self._work())
+        self.requested += 1; self.queue.put_nowait(key)
+        return future
+
+    async def _work(self):
+        while True:
+            key = await self.queue.get()
+            await asyncio.sleep(0)  # 1 つ読むごとにフレームを回す
+            if key not in self.cache: self._store(key, self.load)
+            self.completed += 1
+            future = self.futures[key]
+            if not future.done(): future.set_result(self.cache[key])
+
+    def busy(self):
+        return self.completed < self.requested
+
+    def progress(self):
+        """予約したもののうち読み終えた割合 (0.0 - 1.0)"""
+        return self.completed / self.requested if self.requested else 1.0
+
+# --- 効果音のボイス管理 ---
+# sounds/*.wav の中身は MP3 (clear.wav だけ 48kHz、他は 44.1kHz)。Sound は読み込み時に全体をデコードし、
+# ここで決めた形式の PCM へ変換 (必要ならリサンプル) して持つので、再生中に変換は起きない
+MIXER_SETTINGS = {"frequency": 44100, "size": -16, "channels": 2, "buffer": 512}
+SFX_CATEGORIES = {"item": 2, "damage": 2, "jingle": 1}  # 種類ごとに予約するチャンネル数
+SFX_RULES = {  # 効果音名 -> (種類, 同じ音を鳴らし直すまでの最短間隔 ms, 直近 1 秒に鳴らせる回数)
+    "get_item": ("item", 60, 8), "damage": ("damage", 80, 6),
+    "game_over": ("jingle", 0, 2), "clear": ("jingle", 0, 2),
+}
+
+class VoiceManager:
+    """効果音を種類ごとに予約したチャンネルだけで鳴らす。
+    Sound.play() の自動割り当てと違って他の種類の声を奪わず、同じ音の連打は間隔と回数の上限で間引く。
+    種類のチャンネルが全部鳴っていれば、いちばん前に鳴らし始めたものを止めて使う"""
+    def __init__(self, categories=SFX_CATEGORIES, rules=SFX_RULES):
+        self.categories = categories; self.rules = rules
+        self.sounds = {}; self.channels = {}  # 種類 -> [Channel]
+        self.started = {}  # Channel -> 鳴らし始めた時刻
+        self.last_played = {}; self.recent = {name: deque() for name in rules}
+        self.played = 0; self.stolen = 0; self.dropped = {"cooldown": 0, "rate": 0, "unloaded": 0}
+
+    def setup(self):
+        """ミキサーの初期化後に呼ぶ。先頭のチャンネルを予約して、自動割り当ての Sound.play() や find_channel() に取られないようにする"""
+        total = sum(self.categories.values()); index = 0
+        if pygame.mixer.get_num_channels() < total: pygame.mixer.set_num_channels(total)
+        pygame.mixer.set_reserved(total)
+        for category, count in self.categories.items():
+            self.channels[category] = [pygame.mixer.Channel(index + i) for i in range(count)]; index += count
+
+    def add(self, name, sound): self.sounds[name] = sound
+
+    def play(self, name, now=None):
+        """鳴らしたチャンネルを返す。読み込み前・間隔内・回数超過なら鳴らさずに None"""
+        sound = self.sounds.get(name)
+        if sound is None or not self.channels: self.dropped["unloaded"] += 1; return None
+        if now is None: now = pygame.time.get_ticks()
+        category, cooldown, rate = self.rules[name]
+        last = self.last_played.get(name)
+        if last is not None and now - last < cooldown: self.dropped["cooldown"] += 1; return None
+        recent = self.recent[name]
+        while recent and recent[0] <= now - 1000: recent.popleft()
+        if len(recent) >= rate: self.dropped["rate"] += 1; return None
+        channels = self.channels[category]
+        channel = next((ch for ch in channels if not ch.get_busy()), None)
+        if channel is None: channel = min(channels, key=lambda ch: self.started.get(ch, 0)); self.stolen += 1
+        channel.play(sound)  # 鳴っているチャンネルで play すると前の音はその場で止まる
+        self.started[channel] = now; self.last_played[name] = now; recent.append(now); self.played += 1
+        return channel
+
+    def stats(self):
+        voices = {category: sum(ch.get_busy() for ch in channels) for category, channels in self.channels.items()}
+        return {
+            "voices": voices, "busy": sum(voices.values()), "reserved": sum(self.categories.values()),
+            "played": self.played, "stolen": self.stolen, "dropped": dict(self.dropped),
+            "dropped_total": self.dropped["cooldown"] + self.dropped["rate"],
+        }
+
+# --- 進行状況の保存 (スナップショット + 追記専用の差分ログ) ---
+SAVE_DIR = "save"
+SAVE_DEBOUNCE_MS = 500  # 最後の変更からこれだけ待ってからまとめて書く
+SAVE_COMPACT_RECORDS = 64  # ログがこの件数を超えたらスナップショットに畳む (起動時に読む量の上限)
+
+class FileProgressBackend:
+    """デスクトップ用。progress.json (スナップショット) と progress.log (1 行 1 レコードの追記ログ)"""
+    def __init__(self, directory=SAVE_DIR):
+        self.snapshot_path = os.path.join(directory, "progress.json"); self.log_path = os.path.join(directory, "progress.log")
+        self.directory = directory
+
+    def load(self):
+        snapshot = {"seq": 0, "values": {}}; records = []
+        try:
+            with open(self.snapshot_path) as f: snapshot = json.load(f)
+        except (OSError, ValueError): pass
+        try:
+            with open(self.log_path) as f:
+                for line in f:
+                    try: records.append(json.loads(line))
+                    except ValueError: break  # 書き込み途中で落ちた最後の行
+        except OSError: pass
+        return snapshot, records
+
+    def append(self, records):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.log_path, "a") as f: f.write("".join(json.dumps(record) + "\n" for record in records))
+
+    def compact(self, snapshot, log_seqs):
+        # 先にスナップショットを置き換える。ログを消す前に落ちても、seq が古いレコードは読み飛ばされる
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "w") as f: json.dump(snapshot, f)
+        os.replace(tmp_path, self.snapshot_path)
+        open(self.log_path, "w").close()
+
+class BrowserProgressBackend:
+    """pygbag 用。localStorage には追記がないので、ログは 1 レコード 1 キー (prefix.log.<seq>) にする"""
+    def __init__(self, storage, prefix="tsunami_progress"):
+        self.storage = storage; self.prefix = prefix
+
+    def load(self):
+        text = self.storage.getItem(f"{self.prefix}.snapshot")
+        snapshot = json.loads(text) if text else {"seq": 0, "values": {}}
+        records = []; seq = snapshot["seq"] + 1
+        while (text := self.storage.getItem(f"{self.prefix}.log.{seq}")):
+            records.append(json.loads(text)); seq += 1
+        return snapshot, records
+
+    def append(self, records):
+        for record in records: self.storage.setItem(f"{self.prefix}.log.{record[0]}", json.dumps(record))
+
+    def compact(self, snapshot, log_seqs):
+        self.storage.setItem(f"{self.prefix}.snapshot", json.dumps(snapshot))
+        for seq in log_seqs: self.storage.removeItem(f"{self.prefix}.log.{seq}")
+
+def progress_backend():
+    """ブラウザ (pygbag) なら localStorage、それ以外はローカルファイル"""
+    if sys.platform == "emscripten":
+        try:
+            import platform
+            return BrowserProgressBackend(platform.window.localStorage)
+        except (ImportError, AttributeError) as e: print(f"★ ブラウザの保存領域が使えません ({e})。ファイルに保存します。")
+    return FileProgressBackend()
+
+class ProgressStore:
+    """実績・音量などの小さな key -> value を保存する。
+    set() はメモリ上の値を変えて予約するだけで、書き込みは最後の変更から SAVE_DEBOUNCE_MS 後に
+    ループ上のタスクがまとめて差分レコードとして追記する。ログが溜まったらスナップショットに畳む"""
+    def __init__(self, backend, debounce_ms=SAVE_DEBOUNCE_MS, compact_records=SAVE_COMPACT_RECORDS):
+        self.backend = backend; self.debounce = debounce_ms / 1000; self.compact_records = compact_records
+        self.values = {}; self.seq = 0; self.log_start = 1  # ログに残っている最初の seq
+        self.pending = OrderedDict(); self.due = 0.0; self.task = None
+        self.writes = 0; self.records_written = 0; self.compactions = 0
+
+    def load(self):
+        try: snapshot, records = self.backend.load()
+        except Exception as e: print(f"★ 保存データの読み込みに失敗しました ({e})"); return self.values
+        self.values = dict(snapshot.get("values", {})); self.seq = snapshot.get("seq", 0); self.log_start = self.seq + 1
+        for seq, key, value in records:
+            if seq <= self.seq: continue  # スナップショットに畳み込み済み
+            self.values[key] = value; self.seq = seq
+        if self.seq - self.log_start + 1 >= self.compact_records: self.compact()
+        return self.values
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def set(self, key, value):
+        if self.values.get(key) == value and key not in self.pending: return
+        self.values[key] = value; self.pending[key] = value; self.pending.move_to_end(key)
+        self.due = time.perf_counter() + self.debounce
+        try: loop = asyncio.get_running_loop()
+        except RuntimeError: return  # ループの外 (画面なしの実行など) では flush() を呼んだときに書く
+        if self.task is None or self.task.done(): self.task = loop.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        while (wait := self.due - time.perf_counter()) > 0: await asyncio.sleep(wait)
+        self.flush()
+
+    def flush(self):
+        if not self.pending: return
+        records = []
+        for key, value in self.pending.items(): self.seq += 1; records.append((self.seq, key, value))
+        self.pending.clear()
+        try: self.backend.append(records)
+        except Exception as e: print(f"★ 進行状況の保存に失敗しました ({e})"); return
+        self.writes += 1; self.records_written += len(records)
+        if self.seq - self.log_start + 1 >= self.compact_records: self.compact()
+
+    def compact(self):
+        try: self.backend.compact({"seq": self.seq, "values": self.values}, range(self.log_start, self.seq + 1))
+        except Exception as e: print(f"★ 保存データの整理に失敗しました ({e})"); return
+        self.log_start = self.seq + 1; self.compactions += 1
+
+    def stats(self):
+        return {"keys": len(self.values), "seq": self.seq, "log_records": self.seq - self.log_start + 1, "pending": len(self.pending),
+                "writes": self.writes, "records_written": self.records_written, "compactions": self.compactions}
 
 # --- ゲーム本体クラス ---
 class Game:
-    def __init__(self):
+    def __init__(self, startup=None):
         self.screen = None  
         self.clock = pygame.time.Clock()
+        self.clock.tick()  # pygame.init() を呼ばないので、get_ticks 用のタイマーはここで動かしておく
+        self.startup = startup or StartupReport()
+        self.assets = AssetManager()
         
         # --- フォントのロード (ウェブ対応版) ---
+        with self.startup.stage("fonts"): self.load_fonts()
+            
+        self.bgm_volume = 0.5
+        self.sfx_volume = 0.5
+        
+        self.bgm_paths = {name: os.path.join(SOUND_DIR, file_name) for name, file_name in BGM_FILES.items()}
+        self.current_bgm = None; self.wanted_bgm = None
+        self.sounds_loaded = False; self.audio_task = None
+        self.sfx = VoiceManager()
+
+        self.init_dummy_sounds()  
+
+        self.game_state = STATE_TITLE
+        self.hard_mode_unlocked = False; self.is_hard_mode = False
+        self.achievements = {
+            "survived_1_min": {"text": "1分間 生存する", "unlocked": False},"survived_3_min": {"text": "3分間 生存する", "unlocked": False},
+            "cleared_300m": {"text": "高さ300mをクリア", "unlocked": False},"cleared_800m": {"text": "高さ800mをクリア", "unlocked": False},
+        }
+        self.hard_mode_achievements = {
+            "hm_survived_2_min": {"text": "2分間 生存する", "unlocked": False},"hm_survived_4_min": {"text": "4分間 生存する", "unlocked": False},
+            "hm_cleared_500m": {"text": "高さ500mをクリア", "unlocked": False},"hm_cleared_1000m": {"text": "高さ1000mをクリア", "unlocked": False},
+        }
+        with self.startup.stage("progress"): self.progress = ProgressStore(progress_backend()); self.apply_progress(self.progress.load())
+        self.notification_text = ""; self.notification_time = 0; self.menu_notification = ""
+        self.menu = MenuRenderer()
+        self.dirty_renderer = DirtyRectRenderer()
+        self.sprite_atlas = SpriteAtlas(); self.object_pool = ObjectPool(self.sprite_atlas)
+        self.stepper = FixedStepper()
+        self.recorder = None; self.replay = None
+        self.profiler = FrameProfiler(); self.font_debug = None
+        self.profiler.extra_lines.append(self.text_line); self.profiler.extra_stats["text"] = self.text_stats
+        self.profiler.extra_lines.append(self.allocation_line); self.profiler.extra_stats["allocations"] = self.allocation_stats
+        self.profiler.extra_lines.append(self.respawn_line); self.profiler.extra_stats["respawns"] = self.respawn_stats
+        self.object_store = "sprite"; self.store_names = None; self.profiler.extra_lines.append(self.object_store_line)
+        self.governor = QualityGovernor(); self.profiler.extra_lines.append(self.quality_line); self.low_res = None; self.scaled_images = {}; self.in_play_scene = False
+        self.profiler.extra_lines.append(self.sfx_line)
+        self.stick = TouchStick(); self.input_latency = InputLatency()
+        self.profiler.extra_lines.append(self.input_latency_line); self.profiler.extra_stats["input_latency"] = self.input_latency.stats
+    
+    def apply_progress(self, values):
+        """保存されていた音量・ハードモード解放・実績を反映する (キーは change_volume / unlock_achievement と対応)"""
+        self.bgm_volume = values.get("bgm_volume", self.bgm_volume); self.sfx_volume = values.get("sfx_volume", self.sfx_volume)
+        self.hard_mode_unlocked = values.get("hard_mode_unlocked", self.hard_mode_unlocked)
+        for ach_dict in (self.achievements, self.hard_mode_achievements):
+            for key, ach in ach_dict.items(): ach["unlocked"] = ach["unlocked"] or values.get(f"ach.{key}", False)
+
+    def load_fonts(self):
+        """タイトル画面の最初のフレームに必要なので、フォントだけは起動時に読み込む"""
         self.font_large = None
         self.font_medium = None
         self.font_small = None
@@ -132,15 +1567,15 @@ class Game:
         try:
             font_path = "font.ttf"
             if os.path.exists(font_path):
-                self.font_large = pygame.font.Font(font_path, 74)
-                self.font_medium = pygame.font.Font(font_path, 50)
-                self.font_small = pygame.font.Font(font_path, 30)
+                self.font_large = self.load_font(font_path, 74)
+                self.font_medium = self.load_font(font_path, 50)
+                self.font_small = self.load_font(font_path, 30)
                 print("カスタムフォント (font.ttf) の読み込みに成功しました。")
             else:
                 # 2. デフォルトフォント (None) を試行
-                self.font_large = pygame.font.Font(None, 80)
-                self.font_medium = pygame.font.Font(None, 56)
-                self.font_small = pygame.font.Font(None, 36)
+                self.font_large = self.load_font(None, 80)
+                self.font_medium = self.load_font(None, 56)
+                self.font_small = self.load_font(None, 36)
                 print("システムフォント (None) の読み込みに成功しました。")
         except Exception as e:
             print(f"★ フォントの読み込みに失敗 ({e})。最終手段としてデフォルトのフォントを取得します。")
@@ -149,32 +1584,7 @@ class Game:
             self.font_large = pygame.font.Font(default_font_name, 80)
             self.font_medium = pygame.font.Font(default_font_name, 56)
             self.font_small = pygame.font.Font(default_font_name, 36)
-            
-        self.bgm_volume = 0.5
-        self.sfx_volume = 0.5
-        
-        self.bgm_paths = {
-            "lobby": os.path.join("sounds", "Lobby.wav"),
-            "normal": os.path.join("sounds", "ordinary.wav"),
-            "hard": os.path.join("sounds", "difficult.wav")
-        }
-        self.current_bgm = None
-        self.sounds_loaded = False  
-
-        self.init_dummy_sounds()  
 
-        self.game_state = STATE_TITLE
-        self.hard_mode_unlocked = False; self.is_hard_mode = False
-        self.achievements = {
-            "survived_1_min": {"text": "1分間 生存する", "unlocked": False},"survived_3_min": {"text": "3分間 生存する", "unlocked": False},
-            "cleared_300m": {"text": "高さ300mをクリア", "unlocked": False},"cleared_800m": {"text": "高さ800mをクリア", "unlocked": False},
-        }
-        self.hard_mode_achievements = {
-            "hm_survived_2_min": {"text": "2分間 生存する", "unlocked": False},"hm_survived_4_min": {"text": "4分間 生存する", "unlocked": False},
-            "hm_cleared_500m": {"text": "高さ500mをクリア", "unlocked": False},"hm_cleared_1000m": {"text": "高さ1000mをクリア", "unlocked": False},
-        }
-        self.notification_text = ""; self.notification_time = 0
-    
     def init_dummy_sounds(self):
         """ダミーサウンド（音なし）で変数を初期化する"""
         class DummySound:
@@ -187,36 +1597,65 @@ class Game:
         self.all_sfx = [self.get_item_sound, self.damage_sound, self.game_over_sound, self.clear_sound]
         self.sounds_loaded = False
 
-    def load_real_sounds(self):
-        """★ 実際のサウンドを読み込む（new_gameから呼ばれる）"""
-        if self.sounds_loaded:
-            return  
-            
+    def load_font(self, path, size):
+        """フォントは共有キャッシュ経由で作る (失敗したら例外にして呼び出し側の代替処理に任せる)"""
+        font = self.assets.load_now("font", path, size)
+        if font is None: raise pygame.error(self.assets.failed[("font", path, size)])
+        return font
+
+    def preload_audio(self):
+        """最初のクリック (ブラウザで音を出すのに必要なユーザー操作) で呼ぶ。
+        ミキサーだけはこの場で初期化し、効果音と BGM の読み込みはバックグラウンドで進める"""
+        if self.audio_task is not None: return self.audio_task
         try:
-            pygame.mixer.init()  
-            self.get_item_sound = pygame.mixer.Sound(os.path.join("sounds", "get_item.wav"))
-            self.damage_sound = pygame.mixer.Sound(os.path.join("sounds", "damage.wav"))
-            self.game_over_sound = pygame.mixer.Sound(os.path.join("sounds", "game_over.wav"))
-            self.clear_sound = pygame.mixer.Sound(os.path.join("sounds", "clear.wav"))
+            with self.startup.stage("mixer"): pygame.mixer.init(**MIXER_SETTINGS); self.sfx.setup()
+        except pygame.error as e: print(f"★ ミキサーの初期化に失敗しました: {e}"); self.audio_task = asyncio.get_event_loop().create_future(); self.audio_task.set_result(None); return self.audio_task
+        sfx = {name: self.assets.request("sound", os.path.join(SOUND_DIR, file_name)) for name, file_name in SFX_FILES.items()}
+        bgm = [self.assets.request("music", path) for path in self.bgm_paths.values()]
+        self.audio_task = asyncio.get_event_loop().create_task(self.finish_audio_preload(sfx, bgm))
+        return self.audio_task
+
+    async def finish_audio_preload(self, sfx, bgm):
+        sounds = {name: await future for name, future in sfx.items()}
+        if all(sound is not None for sound in sounds.values()):
+            self.get_item_sound, self.damage_sound = sounds["get_item"], sounds["damage"]
+            self.game_over_sound, self.clear_sound = sounds["game_over"], sounds["clear"]
             self.all_sfx = [self.get_item_sound, self.damage_sound, self.game_over_sound, self.clear_sound]
+            for name, sound in sounds.items(): self.sfx.add(name, sound)
             self.set_sfx_volume()
             self.sounds_loaded = True
             print("サウンドの読み込みに成功しました。")
-        except pygame.error as e:
-            print(f"★ 音声ファイルの読み込みに失敗しました: {e}")
-            self.init_dummy_sounds()  
+        else: print("★ 音声ファイルの読み込みに失敗しました。効果音なしで続けます。")
+        for future in bgm: await future
+        # 読み込み中に要求されていた BGM をここで鳴らす
+        if self.sounds_loaded and self.wanted_bgm: self.play_bgm(self.wanted_bgm)
+
+    def change_volume(self, kind, delta):
+        """kind は "bgm" か "sfx"。0.1 刻みで変えて、保存を予約する"""
+        name = f"{kind}_volume"; volume = min(1.0, max(0.0, round(getattr(self, name) + delta, 1)))
+        setattr(self, name, volume); self.menu.invalidate(name); self.progress.set(name, volume)
+        if not self.sounds_loaded: return
+        if kind == "bgm": pygame.mixer.music.set_volume(volume)
+        else: self.set_sfx_volume()
 
     def set_sfx_volume(self):
         for sfx in self.all_sfx:
             sfx.set_volume(self.sfx_volume)
 
+    def sfx_line(self):
+        stats = self.sfx.stats()
+        return f"効果音: 鳴動 {stats['busy']}/{stats['reserved']} 奪取 {stats['stolen']} 間引き {stats['dropped_total']}"
+
     def play_bgm(self, track_name):
+        self.wanted_bgm = track_name
         if not self.sounds_loaded:  
             return
         if self.current_bgm == track_name:
             return
+        path = self.bgm_paths[track_name]; data = self.assets.get("music", path)
+        if data is None: return  # 読み込み中なら finish_audio_preload が後で鳴らす (失敗していれば鳴らさない)
         try:
-            pygame.mixer.music.load(self.bgm_paths[track_name])
+            pygame.mixer.music.load(io.BytesIO(data), os.path.basename(path))
             pygame.mixer.music.set_volume(self.bgm_volume)
             pygame.mixer.music.play(loops=-1)
             self.current_bgm = track_name
@@ -231,28 +1670,171 @@ class Game:
         if self.notification_text and pygame.time.get_ticks() - self.notification_time < 3000:
             draw_text(self.screen, self.notification_text, self.font_small, GOLD, SCREEN_WIDTH - 20, 20, align="topright")
         else: self.notification_text = ""
+
+    def notification_rect(self):
+        if not self.notification_text or pygame.time.get_ticks() - self.notification_time >= 3000: return pygame.Rect(0, 0, 0, 0)
+        return align_rect(TEXT_CACHE.render(self.notification_text, self.font_small, GOLD).get_rect(), SCREEN_WIDTH - 20, 20, "topright")
     
-    def spawn_object(self, obj_type, player_pos):
-        if obj_type == "glass": img = pygame.Surface((15, 15)); img.fill(GRAY); return WorldObject(obj_type, img, (15, 15), player_pos)
-        elif obj_type == "blue_orb": img = pygame.Surface((25, 25), pygame.SRCALPHA); pygame.draw.circle(img, BLUE, (12,12), 12); return WorldObject(obj_type, img, (25, 25), player_pos)
-        elif obj_type == "green_orb": img = pygame.Surface((25, 25), pygame.SRCALPHA); pygame.draw.circle(img, GREEN, (12,12), 12); return WorldObject(obj_type, img, (25, 25), player_pos)
-        elif obj_type == "stairs": img = pygame.Surface((40, 40)); img.fill(WHITE); return WorldObject(obj_type, img, (40, 40), player_pos)
-
-    def new_game(self):
-        self.load_real_sounds()  
+    def sync_menu_notification(self):
+        """メニュー画面では通知をウィジェットとして出し入れする (出たときと消えるときだけ描き直す)"""
+        text = self.notification_text if self.notification_rect().width else ""
+        if text == self.menu_notification and (not text or "notification" in self.menu.widgets): return
+        self.menu_notification = text
+        if not text: self.menu.remove("notification"); return
+        # 右上はメニューのボタンと重なるので、画面下の中央に背景付きで出す
+        box = align_rect(TEXT_CACHE.render(text, self.font_small, GOLD).get_rect(), SCREEN_WIDTH // 2, SCREEN_HEIGHT - 100, "center").inflate(24, 12)
+        def draw(surface): pygame.draw.rect(surface, BLACK, box); pygame.draw.rect(surface, GOLD, box, 2); draw_text(surface, text, self.font_small, GOLD, box.centerx, box.centery)
+        self.menu.add("notification", box, draw)
+
+    def update_visible_objects(self):
+        """画面と重なるオブジェクトだけ画面座標を更新し、描画対象として保持する"""
+        screen_rect = self.screen.get_rect() if self.screen else pygame.Rect(0, 0, SCREEN_WIDTH, SCREEN_HEIGHT)
+        self.visible_objects = visible = self.sim.object_grid.colliding(screen_rect, *self.camera)
+        return visible
+
+    def debug_font(self):
+        if self.font_debug is None: self.font_debug = pygame.font.Font(None, 24)
+        return self.font_debug
+
+    def profiler_overlay(self):
+        """MenuRenderer / DirtyRectRenderer の present に渡すオーバーレイ描画関数 (非表示なら None)"""
+        if not self.profiler.overlay: return None
+        return lambda screen: self.profiler.draw_overlay(screen, self.debug_font())
+
+    HUD_LABELS = ("hud_stamina", "hud_target", "hud_height", "hud_distance", "hud_pixels")
+
+    def text_stats(self):
+        """テキストキャッシュの再利用状況と、今のプレイ画面で HUD ラベルを描き直した回数"""
+        labels = [getattr(self, name, None) for name in self.HUD_LABELS]
+        return dict(TEXT_CACHE.stats(), hud_renders=sum(label.renders for label in labels if label is not None))
+
+    def text_line(self):
+        stats = self.text_stats()
+        return f"文字: ヒット {stats['hit_rate']:.0%} ミス {stats['misses']} 追い出し {stats['evictions']} HUD再描画 {stats['hud_renders']}"
+
+    def object_store_line(self):
+        count = self.sim.object_grid.count if getattr(self, "sim", None) else 0
+        return f"objects: {self.object_store} x{count} (F5)"
+
+    def input_latency_line(self):
+        stats = self.input_latency.stats()
+        return f"入力→表示: p50 {stats['p50_ms']:.1f} ms p95 {stats['p95_ms']:.1f} ms 読取後 {stats['sample_to_flip_p50_ms']:.1f} ms (n={stats['count']})"
+
+    def quality_line(self):
+        settings = self.governor.settings(); state = "" if self.governor.enabled else " 固定"
+        return f"品質: {self.governor.tier} {settings['name']} {self.governor.fps(FPS)}Hz{state} (F6)"
+
+    def apply_quality(self):
+        """ガバナーの今の段の設定を文字・津波・描画に反映する"""
+        settings = self.governor.settings()
+        if self.in_play_scene: TEXT_CACHE.antialias = settings["antialias"]
+        self.tsunami.wave_effects = settings["wave_effects"]
+        self.dirty_renderer.invalidate_all()
+
+    def toggle_governor(self):
+        """F6: 品質の自動調整を止めて最高品質に固定する / 再開する"""
+        governor = self.governor; governor.enabled = not governor.enabled
+        if not governor.enabled: governor.set_tier(0, pygame.time.get_ticks()); self.apply_quality()
+        self.set_notification("品質の自動調整: " + ("オン" if governor.enabled else "オフ"))
+
+    def toggle_object_store(self):
+        """F5: オブジェクト置き場を sprite (空間ハッシュ) と numpy (構造体配列) で切り替える"""
+        if self.store_names is None:
+            with self.startup.stage("numpy"): self.store_names = available_stores()  # 初めて押されたときに numpy を読み込む
+        names = self.store_names
+        if len(names) == 1: self.set_notification("numpy がないため切り替えられません"); return
+        self.object_store = names[(names.index(self.object_store) + 1) % len(names)]
+        self.sim.switch_store(self.object_store); self.set_notification(f"オブジェクト: {self.object_store}")
+
+    def handle_window_event(self, event):
+        """窓が再び見えたら、保持している画面を捨てて次のフレームで全体を描き直す"""
+        if event.type != pygame.WINDOWEXPOSED: return False
+        self.menu.invalidate(); self.dirty_renderer.invalidate_all(); return True
+
+    def handle_debug_key(self, event):
+        """F3: プロファイラのオーバーレイ切り替え / F4: 計測結果を JSON・CSV・Chrome トレースで書き出す"""
+        if event.type != pygame.KEYDOWN: return False
+        if event.key == pygame.K_F3: self.profiler.overlay = not self.profiler.overlay; return True
+        if event.key == pygame.K_F4:
+            try: paths = self.profiler.export(); self.set_notification("プロファイルを書き出しました"); print("プロファイル:", ", ".join(paths))
+            except OSError as e: print(f"プロファイルを書き出せません: {e}")
+            return True
+        return False
+
+    def read_input(self):
+        """キーボード (WASD) と仮想スティック (タッチ/マウス) を INPUT_* のビット和にまとめる。
+        イベントを取り出した (= SDL がキーとマウスの状態を更新した) 後に呼ぶ"""
+        keys = pygame.key.get_pressed(); inputs = 0
+        if keys[pygame.K_w]: inputs |= INPUT_UP
+        if keys[pygame.K_s]: inputs |= INPUT_DOWN
+        if keys[pygame.K_a]: inputs |= INPUT_LEFT
+        if keys[pygame.K_d]: inputs |= INPUT_RIGHT
+        return inputs | self.stick.read()
+
+    def allocation_stats(self):
+        """定常状態で新しい面やオブジェクトが作られていないことを確認するためのカウンタ"""
+        return {"surfaces_created": self.sprite_atlas.surfaces_created, "objects_created": self.object_pool.objects_created, "objects_reused": self.object_pool.objects_reused}
+
+    def respawn_stats(self):
+        """再出現待ちの件数 (queued) と、予約・復活の累計"""
+        return self.sim.respawns.stats() if getattr(self, "sim", None) else {}
+
+    def respawn_line(self):
+        stats = self.respawn_stats()
+        if not stats: return "再出現: -"
+        return f"再出現: 待ち {stats['queued']} 予約 {stats['scheduled']} 復活 {stats['spawned']} 配置 {sum(stats['live'].values())}"
+
+    def allocation_line(self):
+        stats = self.allocation_stats()
+        return f"確保: 面 {stats['surfaces_created']} オブジェクト {stats['objects_created']} (再利用 {stats['objects_reused']})"
+
+    def new_game(self, seed=None):
+        self.preload_audio()  
         self.play_bgm("hard" if self.is_hard_mode else "normal")
         
-        self.all_sprites = pygame.sprite.Group(); self.glass_sprites = pygame.sprite.Group()
-        self.blue_orb_sprites = pygame.sprite.Group(); self.green_orb_sprites = pygame.sprite.Group()
-        self.stair_sprites = pygame.sprite.Group()
-        self.player = Player(); self.tsunami = Tsunami(self.player.base_speed)
-        self.start_time = pygame.time.get_ticks(); self.last_height_gain = self.start_time
-        player_pos = (self.player.world_x, self.player.world_y)
-        for _ in range(20): obj = self.spawn_object("glass", player_pos); self.all_sprites.add(obj); self.glass_sprites.add(obj)
-        for _ in range(1): obj = self.spawn_object("blue_orb", player_pos); self.all_sprites.add(obj); self.blue_orb_sprites.add(obj)
-        for _ in range(3): obj = self.spawn_object("green_orb", player_pos); self.all_sprites.add(obj); self.green_orb_sprites.add(obj)
-        for _ in range(10): obj = self.spawn_object("stairs", player_pos); self.all_sprites.add(obj); self.stair_sprites.add(obj)
-        self.object_respawn_timers = []
+        if seed is None: seed = random.getrandbits(32)
+        self.close_simulation()
+        self.sim = Simulation(seed, "hard" if self.is_hard_mode else "normal", self.sprite_atlas, self.object_pool)
+        self.start_recording(); self.replay = None
+        self.attach_simulation()
+
+    def start_recording(self):
+        """毎回のプレイを LAST_REPLAY に記録する (書き込めない環境では記録しない)"""
+        if self.recorder: self.recorder.close()
+        try: self.recorder = ReplayWriter(LAST_REPLAY, self.sim.seed, self.sim.mode)
+        except OSError as e: print(f"リプレイを記録できません: {e}"); self.recorder = None
+
+    def stop_recording(self):
+        if self.recorder: self.recorder.close(); self.recorder = None
+
+    def start_replay(self, path=LAST_REPLAY):
+        """記録したプレイを描画付きで再生する。← / → で 10 秒戻る / 進む"""
+        try: replay = ReplayPlayer(path, self.sprite_atlas, self.object_pool)
+        except (OSError, ValueError) as e: self.set_notification("リプレイがありません"); print(e); return False
+        self.close_simulation(); self.replay = replay
+        self.sim = replay.sim; self.is_hard_mode = self.sim.mode == "hard"
+        self.attach_simulation(); self.game_state = STATE_REPLAY
+        return True
+
+    def close_simulation(self):
+        """今のシミュレーションのオブジェクトをプールへ返す (次のゲームで使い回す)"""
+        if getattr(self, "sim", None) is not None: self.sim.close()
+
+    def attach_simulation(self):
+        self.sim.profiler = self.profiler; self.sim.switch_store(self.object_store)
+        self.player = self.sim.player; self.tsunami = self.sim.tsunami; self.visible_objects = []
+        self.apply_quality()
+        self.prev_view = self.view_state(); self.interpolate_view(1.0)
+
+    def view_state(self):
+        """描画の補間に使うシミュレーション状態 (カメラ = プレイヤーのワールド座標と、津波の前線)"""
+        return self.player.world_x, self.player.world_y, self.tsunami.world_y
+
+    def interpolate_view(self, alpha):
+        """直前のティックと現在のティックの間を alpha で補間した位置に描画する"""
+        (x0, y0, t0), (x1, y1, t1) = self.prev_view, self.view_state()
+        cx = x0 + (x1 - x0) * alpha; cy = y0 + (y1 - y0) * alpha; ty = t0 + (t1 - t0) * alpha
+        self.camera = (cx, cy); self.tsunami_top = int(ty - cy + SCREEN_HEIGHT / 2)
     
     # ★ 各ループ (show_title_screen, play_game など) は async def に変更
     async def show_title_screen(self):
@@ -263,101 +1845,108 @@ class Game:
         y_pos = SCREEN_HEIGHT - 80; bgm_minus_btn = pygame.Rect(100, y_pos, 40, 40); bgm_plus_btn = pygame.Rect(320, y_pos, 40, 40)
         sfx_minus_btn = pygame.Rect(SCREEN_WIDTH - 360, y_pos, 40, 40); sfx_plus_btn = pygame.Rect(SCREEN_WIDTH - 140, y_pos, 40, 40)
         
+        menu = self.menu; menu.reset()
+        menu.add_text("title", "津波から逃げろ！", self.font_large, WHITE, SCREEN_WIDTH / 2, SCREEN_HEIGHT / 5)
+        menu.add_button("play", play_button, GRAY, "プレイ / Enter", self.font_medium)
+        menu.add_button("rules", rules_button, GRAY, "ルール / R", self.font_medium)
+        menu.add_button("achievements", achieve_button, GRAY, "実績 / C", self.font_small)
+        if self.hard_mode_unlocked: menu.add_button("hard_mode", hard_mode_button, DARK_RED, "ハードモード / H", self.font_medium)
+        menu.add_button("bgm_minus", bgm_minus_btn, GRAY, "-", self.font_medium); menu.add_button("bgm_plus", bgm_plus_btn, GRAY, "+", self.font_medium)
+        menu.add_text("bgm_volume", lambda: f"BGM: {int(self.bgm_volume * 100)}%", self.font_small, WHITE, 230, y_pos + 20, box=(150, y_pos, 160, 40))
+        menu.add_button("sfx_minus", sfx_minus_btn, GRAY, "-", self.font_medium); menu.add_button("sfx_plus", sfx_plus_btn, GRAY, "+", self.font_medium)
+        menu.add_text("sfx_volume", lambda: f"SFX: {int(self.sfx_volume * 100)}%", self.font_small, WHITE, SCREEN_WIDTH - 250, y_pos + 20, box=(SCREEN_WIDTH - 330, y_pos, 160, 40))
+        menu.add_text("loading", lambda: f"読み込み中... {int(self.assets.progress() * 100)}%" if self.assets.busy() else "", self.font_small, GRAY, SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2 - 40, box=(SCREEN_WIDTH / 2 - 200, SCREEN_HEIGHT / 2 - 60, 400, 40))
+        shown_progress = None
+        
         # ループに入る前に1回描画とフリップを実行 (ウェブ環境でのフリーズ対策)
-        self.screen.fill(BLACK)
-        draw_text(self.screen, "津波から逃げろ！", self.font_large, WHITE, SCREEN_WIDTH / 2, SCREEN_HEIGHT / 5)
-        # 描画省略
-        pygame.display.flip() 
+        menu.present(self.screen); self.startup.first_frame()
         await asyncio.sleep(0) # ブラウザに制御を返す
         
         while self.game_state == STATE_TITLE:
-            self.clock.tick(FPS); self.screen.fill(BLACK)
-            draw_text(self.screen, "津波から逃げろ！", self.font_large, WHITE, SCREEN_WIDTH / 2, SCREEN_HEIGHT / 5)
-            pygame.draw.rect(self.screen, GRAY, play_button); pygame.draw.rect(self.screen, GRAY, rules_button); pygame.draw.rect(self.screen, GRAY, achieve_button)
-            draw_text(self.screen, "プレイ / Enter", self.font_medium, WHITE, play_button.centerx, play_button.centery)
-            draw_text(self.screen, "ルール / R", self.font_medium, WHITE, rules_button.centerx, rules_button.centery)
-            draw_text(self.screen, "実績 / C", self.font_small, WHITE, achieve_button.centerx, achieve_button.centery)
-            if self.hard_mode_unlocked:
-                pygame.draw.rect(self.screen, DARK_RED, hard_mode_button); draw_text(self.screen, "ハードモード / H", self.font_medium, WHITE, hard_mode_button.centerx, hard_mode_button.centery)
-            pygame.draw.rect(self.screen, GRAY, bgm_minus_btn); draw_text(self.screen, "-", self.font_medium, WHITE, bgm_minus_btn.centerx, bgm_minus_btn.centery)
-            pygame.draw.rect(self.screen, GRAY, bgm_plus_btn); draw_text(self.screen, "+", self.font_medium, WHITE, bgm_plus_btn.centerx, bgm_plus_btn.centery)
-            draw_text(self.screen, f"BGM: {int(self.bgm_volume * 100)}%", self.font_small, WHITE, 230, y_pos + 20)
-            pygame.draw.rect(self.screen, GRAY, sfx_minus_btn); draw_text(self.screen, "-", self.font_medium, WHITE, sfx_minus_btn.centerx, sfx_minus_btn.centery)
-            pygame.draw.rect(self.screen, GRAY, sfx_plus_btn); draw_text(self.screen, "+", self.font_medium, WHITE, sfx_plus_btn.centerx, sfx_plus_btn.centery)
-            draw_text(self.screen, f"SFX: {int(self.sfx_volume * 100)}%", self.font_small, WHITE, SCREEN_WIDTH - 250, y_pos + 20)
+            self.profiler.frame(); self.clock.tick(FPS); self.profiler.mark("idle")
             
             events = pygame.event.get()
             for event in events:
+                self.handle_window_event(event); self.handle_debug_key(event)
                 if event.type == pygame.QUIT: self.running = False; return
+                # 最初のクリック (キー入力) でブラウザの音声制限が解けるので、ここで音の読み込みを始める
+                if event.type in (pygame.MOUSEBUTTONDOWN, pygame.KEYDOWN): self.preload_audio()
                 if event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_RETURN: self.is_hard_mode = False; self.game_state = STATE_PLAYING; self.new_game(); return
                     if event.key == pygame.K_r: self.game_state = STATE_RULES; return
                     if event.key == pygame.K_c: self.game_state = STATE_ACHIEVEMENTS; return
                     if event.key == pygame.K_h and self.hard_mode_unlocked: self.is_hard_mode = True; self.game_state = STATE_PLAYING; self.new_game(); return
+                    if event.key == pygame.K_v and self.start_replay(): return
                 
                 if event.type == pygame.MOUSEBUTTONDOWN:
                     if play_button.collidepoint(event.pos): self.is_hard_mode = False; self.game_state = STATE_PLAYING; self.new_game(); return
                     if rules_button.collidepoint(event.pos): self.game_state = STATE_RULES; return
                     if achieve_button.collidepoint(event.pos): self.game_state = STATE_ACHIEVEMENTS; return
                     if self.hard_mode_unlocked and hard_mode_button.collidepoint(event.pos): self.is_hard_mode = True; self.game_state = STATE_PLAYING; self.new_game(); return
-                    if bgm_minus_btn.collidepoint(event.pos): 
-                        self.bgm_volume = max(0.0, round(self.bgm_volume - 0.1, 1))
-                        if self.sounds_loaded: pygame.mixer.music.set_volume(self.bgm_volume)
-                    if bgm_plus_btn.collidepoint(event.pos): 
-                        self.bgm_volume = min(1.0, round(self.bgm_volume + 0.1, 1))
-                        if self.sounds_loaded: pygame.mixer.music.set_volume(self.bgm_volume)
-                    if sfx_minus_btn.collidepoint(event.pos): 
-                        self.sfx_volume = max(0.0, round(self.sfx_volume - 0.1, 1))
-                        if self.sounds_loaded: self.set_sfx_volume()
-                    if sfx_plus_btn.collidepoint(event.pos): 
-                        self.sfx_volume = min(1.0, round(self.sfx_volume + 0.1, 1))
-                        if self.sounds_loaded: self.set_sfx_volume()
+                    if bgm_minus_btn.collidepoint(event.pos): self.change_volume("bgm", -0.1)
+                    if bgm_plus_btn.collidepoint(event.pos): self.change_volume("bgm", 0.1)
+                    if sfx_minus_btn.collidepoint(event.pos): self.change_volume("sfx", -0.1)
+                    if sfx_plus_btn.collidepoint(event.pos): self.change_volume("sfx", 0.1)
             
-            pygame.display.flip()
+            progress = (self.assets.busy(), self.assets.progress())
+            if progress != shown_progress: menu.invalidate("loading"); shown_progress = progress
+            self.profiler.mark("events"); self.sync_menu_notification(); menu.present(self.screen, self.profiler_overlay()); self.profiler.mark("flip")
             await asyncio.sleep(0) # ★ pygbag用
 
+    def build_achievement_rows(self, menu, ach_dict, y_offset):
+        for key, ach in ach_dict.items():
+            menu.add_text(f"ach_text_{key}", ach["text"], self.font_small, GRAY, SCREEN_WIDTH / 2 - 200, y_offset, align="topleft")
+            def draw_status(surface, ach=ach, y=y_offset):
+                if ach["unlocked"]: draw_text(surface, "【達成】", self.font_small, GOLD, SCREEN_WIDTH / 2 + 250, y, align="topleft")
+                else: draw_text(surface, "【未達成】", self.font_small, WHITE, SCREEN_WIDTH / 2 + 250, y, align="topleft")
+            menu.add(f"ach_{key}", (SCREEN_WIDTH / 2 + 250, y_offset, 200, 40), draw_status)
+            y_offset += 50
+        return y_offset
+
     async def show_achievements_screen(self):
         back_button = pygame.Rect(20, 20, 150, 60)
+        menu = self.menu; menu.reset()
+        menu.add_text("normal_header", "ノーマルモード実績", self.font_medium, WHITE, SCREEN_WIDTH / 2, 80)
+        y_offset = self.build_achievement_rows(menu, self.achievements, 140)
+        if self.hard_mode_unlocked:
+            y_offset += 20; menu.add_text("hard_header", "ハードモード実績", self.font_medium, RED, SCREEN_WIDTH / 2, y_offset); y_offset += 60
+            self.build_achievement_rows(menu, self.hard_mode_achievements, y_offset)
+        menu.add_button("back", back_button, GRAY, "戻る / Q", self.font_small)
         while self.game_state == STATE_ACHIEVEMENTS:
-            self.clock.tick(FPS); self.screen.fill(BLACK)
-            draw_text(self.screen, "ノーマルモード実績", self.font_medium, WHITE, SCREEN_WIDTH / 2, 80)
-            y_offset = 140
-            for ach in self.achievements.values():
-                draw_text(self.screen, ach["text"], self.font_small, GRAY, SCREEN_WIDTH / 2 - 200, y_offset, align="topleft")
-                if ach["unlocked"]: draw_text(self.screen, "【達成】", self.font_small, GOLD, SCREEN_WIDTH / 2 + 250, y_offset, align="topleft")
-                else: draw_text(self.screen, "【未達成】", self.font_small, WHITE, SCREEN_WIDTH / 2 + 250, y_offset, align="topleft")
-                y_offset += 50
-            if self.hard_mode_unlocked:
-                y_offset += 20; draw_text(self.screen, "ハードモード実績", self.font_medium, RED, SCREEN_WIDTH / 2, y_offset); y_offset += 60
-                for ach in self.hard_mode_achievements.values():
-                    draw_text(self.screen, ach["text"], self.font_small, GRAY, SCREEN_WIDTH / 2 - 200, y_offset, align="topleft")
-                    if ach["unlocked"]: draw_text(self.screen, "【達成】", self.font_small, GOLD, SCREEN_WIDTH / 2 + 250, y_offset, align="topleft")
-                    else: draw_text(self.screen, "【未達成】", self.font_small, WHITE, SCREEN_WIDTH / 2 + 250, y_offset, align="topleft")
-                    y_offset += 50
-            pygame.draw.rect(self.screen, GRAY, back_button); draw_text(self.screen, "戻る / Q", self.font_small, WHITE, back_button.centerx, back_button.centery)
+            self.profiler.frame(); self.clock.tick(FPS); self.profiler.mark("idle")
             
             events = pygame.event.get()
             for event in events:
+                self.handle_window_event(event); self.handle_debug_key(event)
                 if event.type == pygame.QUIT: self.running = False; return
                 if event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_q: self.game_state = STATE_TITLE; return
                 if event.type == pygame.MOUSEBUTTONDOWN:
                     if back_button.collidepoint(event.pos): self.game_state = STATE_TITLE; return
-            pygame.display.flip()
+            self.profiler.mark("events"); self.sync_menu_notification(); menu.present(self.screen, self.profiler_overlay()); self.profiler.mark("flip")
             await asyncio.sleep(0) # ★ pygbag用
 
+    def build_rules_page(self, menu, rules_pages, current_page, prev_button, next_button):
+        for name in [name for name in menu.widgets if name.startswith("rule_line_")]: menu.remove(name)
+        for i, line in enumerate(rules_pages[current_page]): menu.add_text(f"rule_line_{i}", line, self.font_small, WHITE, SCREEN_WIDTH / 2, 100 + i * 40)
+        if current_page > 0: menu.add_button("prev", prev_button, GRAY, "← / A", self.font_small)
+        else: menu.remove("prev")
+        if current_page < len(rules_pages) - 1: menu.add_button("next", next_button, GRAY, "→ / D", self.font_small)
+        else: menu.remove("next")
+
     async def show_rules_screen(self):
         rules_pages = [["--- ルール (1/2) ---","下から迫りくる津波から逃げるゲームです。","W, A, S, Dキー または タッチ で移動します。","キャラクターは画面中央に固定され、世界が動きます。","目標の高さまで到達すればクリアです。","","--- スタミナ ---","左上の緑のバーがスタミナです。","移動すると減少し、速度が低下します。","止まると回復します。"],["--- アイテムと障害物 (2/2) ---","[階段]: 白いオブジェクト。触れると高さが10上昇します。","[緑の球]: スタミナが20回復します。","[青い球]: 津波の速度を一時的に一段階下げます。","[ガラス片]: 灰色のオブジェクト。触れるとスタミナが30減少します。","","--- ハードモード ---","ノーマル実績を全て達成すると解放されます。","より過酷な環境で高みを目指しましょう。"]]
         current_page = 0; back_button = pygame.Rect(20, 20, 150, 60); prev_button = pygame.Rect(SCREEN_WIDTH/2 - 100, SCREEN_HEIGHT - 80, 80, 60); next_button = pygame.Rect(SCREEN_WIDTH/2 + 20, SCREEN_HEIGHT - 80, 80, 60)
+        menu = self.menu; menu.reset()
+        menu.add_button("back", back_button, GRAY, "戻る / Q", self.font_small)
+        self.build_rules_page(menu, rules_pages, current_page, prev_button, next_button)
         while self.game_state == STATE_RULES:
-            self.clock.tick(FPS); self.screen.fill(BLACK)
-            for i, line in enumerate(rules_pages[current_page]): draw_text(self.screen, line, self.font_small, WHITE, SCREEN_WIDTH / 2, 100 + i * 40)
-            pygame.draw.rect(self.screen, GRAY, back_button); draw_text(self.screen, "戻る / Q", self.font_small, WHITE, back_button.centerx, back_button.centery)
-            if current_page > 0: pygame.draw.rect(self.screen, GRAY, prev_button); draw_text(self.screen, "← / A", self.font_small, WHITE, prev_button.centerx, prev_button.centery)
-            if current_page < len(rules_pages) - 1: pygame.draw.rect(self.screen, GRAY, next_button); draw_text(self.screen, "→ / D", self.font_small, WHITE, next_button.centerx, next_button.centery)
+            self.profiler.frame(); self.clock.tick(FPS); self.profiler.mark("idle")
+            shown_page = current_page
             
             events = pygame.event.get()
             for event in events:
+                self.handle_window_event(event); self.handle_debug_key(event)
                 if event.type == pygame.QUIT: self.running = False; return
                 if event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_q: self.game_state = STATE_TITLE; return
@@ -367,113 +1956,178 @@ class Game:
                     if back_button.collidepoint(event.pos): self.game_state = STATE_TITLE; return
                     if prev_button.collidepoint(event.pos) and current_page > 0: current_page -= 1
                     if next_button.collidepoint(event.pos) and current_page < len(rules_pages) - 1: current_page += 1
-            pygame.display.flip()
+            if current_page != shown_page: self.build_rules_page(menu, rules_pages, current_page, prev_button, next_button)
+            self.profiler.mark("events"); self.sync_menu_notification(); menu.present(self.screen, self.profiler_overlay()); self.profiler.mark("flip")
             await asyncio.sleep(0) # ★ pygbag用
 
     async def play_game(self):
+        """文字のアンチエイリアスを切るのはプレイ画面の間だけ (メニューは軽いので常に最高品質で描く)"""
+        self.in_play_scene = True; TEXT_CACHE.antialias = self.governor.settings()["antialias"]
+        try: await self.play_loop()
+        finally: self.in_play_scene = False; TEXT_CACHE.antialias = True
+
+    async def play_loop(self):
         pygame.mouse.set_visible(False)
         
         bg_color = DARK_RED if self.is_hard_mode else BLACK
-        glass_respawn = 500 if self.is_hard_mode else 1000
-        other_respawn = 5000 if self.is_hard_mode else 1667
-        glass_damage = 60 if self.is_hard_mode else 30
+        self.hud_stamina = HudLabel("スタミナ: {}", self.font_small, WHITE, 110, 25)
+        self.hud_target = HudLabel("目標: {} m", self.font_small, WHITE, SCREEN_WIDTH - 20, 25, align="topright")
+        self.hud_height = HudLabel("高さ: {} m", self.font_small, WHITE, SCREEN_WIDTH - 20, 65, align="topright")
+        self.hud_distance = HudLabel("津波との距離: {} m", self.font_small, WHITE, SCREEN_WIDTH - 20, 105, align="topright")
+        self.hud_pixels = HudLabel("更新ピクセル: {}", self.font_small, GRAY, 20, SCREEN_HEIGHT - 40, align="topleft")
+        self.play_bg_color = bg_color
+        self.dirty_renderer.reset(); last_camera = None
+        stepper = self.stepper; stepper.reset(); self.clock.tick(); self.stick.reset()
+        latency = self.input_latency; latency.reset()
+        replay = self.replay if self.game_state == STATE_REPLAY else None
         
-        while self.game_state == STATE_PLAYING:
-            self.clock.tick(FPS); now = pygame.time.get_ticks()
+        while self.game_state in (STATE_PLAYING, STATE_REPLAY):
+            prof = self.profiler; prof.frame()
+            elapsed = self.clock.tick(self.governor.fps(FPS)); prof.mark("idle")
+            if self.governor.sample(elapsed, self.clock.get_rawtime(), pygame.time.get_ticks()): self.apply_quality()
             
-            mouse_pressed = pygame.mouse.get_pressed()[0]  
-
-            events = pygame.event.get()
+            latency.poll(time.perf_counter() * 1000); events = pygame.event.get()
             for event in events:
-                if event.type == pygame.QUIT: self.running = False; return
+                if replay is None and self.stick.handle_event(event): continue
+                self.handle_window_event(event); self.handle_debug_key(event)
+                if event.type == pygame.QUIT: self.stop_recording(); self.running = False; return
                 if event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_ESCAPE: self.game_state = STATE_TITLE; return
+                    if event.key == pygame.K_ESCAPE: self.stop_recording(); self.game_state = STATE_TITLE; return
+                    if event.key == pygame.K_F2: self.dirty_renderer.enabled = not self.dirty_renderer.enabled; self.dirty_renderer.reset()
+                    if event.key == pygame.K_F5: self.toggle_object_store()
+                    if event.key == pygame.K_F6: self.toggle_governor()
+                    if replay and event.key in (pygame.K_LEFT, pygame.K_RIGHT):
+                        offset = REPLAY_SNAPSHOT_INTERVAL if event.key == pygame.K_RIGHT else -REPLAY_SNAPSHOT_INTERVAL
+                        replay.seek(self.sim.ticks + offset); self.prev_view = self.view_state(); self.dirty_renderer.invalidate_all()
+            prof.mark("events")
 
-            if mouse_pressed:
-                mouse_pos = pygame.mouse.get_pos()
-                if mouse_pos[0] < SCREEN_WIDTH / 2: self.player.moving_left = True
-                else: self.player.moving_right = True
-                if mouse_pos[1] < SCREEN_HEIGHT / 2: self.player.moving_up = True
-                else: self.player.moving_down = True
+            # 入力はイベントを取り出した直後、ティックを進める直前に読む (取り出す前だとキーの状態が 1 フレーム古い)
+            inputs = self.read_input() if replay is None else 0
+            latency.sample(inputs)
+            prof.mark("input")
 
-            self.player.update(); self.tsunami.update(self.player.world_y)
+            # 描画のフレームレートに関係なく、シミュレーションは常に TICK_RATE で進める
+            for _ in range(stepper.advance(elapsed)):
+                latency.stepped()
+                self.prev_view = self.view_state()
+                if replay:
+                    if replay.done(): self.game_state = STATE_TITLE; return
+                    sim_events = replay.step()
+                else:
+                    if self.recorder: self.recorder.record(inputs)
+                    sim_events = self.sim.step(inputs)
+                for sim_event in sim_events:
+                    self.sfx.play("damage" if sim_event == "damage" else "get_item")
+                if self.sim.state != STATE_PLAYING and replay is None:
+                    self.stop_recording()
+                    self.final_survival_time = self.sim.final_survival_time; self.final_height = self.sim.final_height
+                    self.game_state = self.sim.state; self.check_achievements(); return
             
-            player_pos = (self.player.world_x, self.player.world_y)
-            for obj in self.all_sprites:
-                if obj.update(self.player.world_x, self.player.world_y):
-                    respawn_delay = glass_respawn if obj.type == 'glass' else other_respawn
-                    self.object_respawn_timers.append((now + respawn_delay, obj.type, player_pos)); obj.kill()
-            
-            hits = pygame.sprite.spritecollide(self.player, self.glass_sprites, True)
-            for hit in hits: self.damage_sound.play(); self.player.stamina -= glass_damage; self.object_respawn_timers.append((now + glass_respawn, hit.type, player_pos))
-            hits = pygame.sprite.spritecollide(self.player, self.blue_orb_sprites, True)
-            for hit in hits: self.get_item_sound.play(); self.tsunami.slow_down(); self.object_respawn_timers.append((now + other_respawn, hit.type, player_pos))
-            hits = pygame.sprite.spritecollide(self.player, self.green_orb_sprites, True)
-            for hit in hits: self.get_item_sound.play(); self.player.stamina += 20; self.object_respawn_timers.append((now + other_respawn, hit.type, player_pos))
-            hits = pygame.sprite.spritecollide(self.player, self.stair_sprites, True)
-            for hit in hits: self.get_item_sound.play(); self.player.height += 10; self.object_respawn_timers.append((now + other_respawn, hit.type, player_pos))
-            
-            for i in range(len(self.object_respawn_timers) - 1, -1, -1):
-                spawn_time, obj_type, pos = self.object_respawn_timers[i]
-                if now >= spawn_time:
-                    if (obj_type == "glass" and len(self.glass_sprites) < 20) or (obj_type == "blue_orb" and len(self.blue_orb_sprites) < 1) or (obj_type == "green_orb" and len(self.green_orb_sprites) < 3) or (obj_type == "stairs" and len(self.stair_sprites) < 10):
-                        new_obj = self.spawn_object(obj_type, pos)
-                        self.all_sprites.add(new_obj)
-                        if obj_type == "glass": self.glass_sprites.add(new_obj)
-                        elif obj_type == "blue_orb": self.blue_orb_sprites.add(new_obj)
-                        elif obj_type == "green_orb": self.green_orb_sprites.add(new_obj)
-                        elif obj_type == "stairs": self.stair_sprites.add(new_obj)
-                    self.object_respawn_timers.pop(i)
-            
-            if now - self.last_height_gain > 10000: self.player.height += 1; self.last_height_gain = now
-            if self.player.rect.bottom >= self.tsunami.rect.y:
-                self.final_survival_time = (now - self.start_time) / 1000; self.game_state = STATE_GAME_OVER; self.check_achievements(); return
-            if self.player.height >= self.tsunami.target_height:
-                self.final_survival_time = (now - self.start_time) / 1000; self.final_height = self.player.height; self.game_state = STATE_CLEAR; self.check_achievements(); return
-            
-            self.screen.fill(bg_color); self.screen.blit(self.tsunami.image, self.tsunami.rect); self.all_sprites.draw(self.screen); self.screen.blit(self.player.image, self.player.rect)
-            stamina_ratio = self.player.stamina / self.player.max_stamina
-            pygame.draw.rect(self.screen, RED, (10, 10, 200, 30)); pygame.draw.rect(self.screen, GREEN, (10, 10, 200 * stamina_ratio, 30));
-            draw_text(self.screen, f"スタミナ: {int(self.player.stamina)}", self.font_small, WHITE, 110, 25)
-            draw_text(self.screen, f"目標: {self.tsunami.target_height} m", self.font_small, WHITE, SCREEN_WIDTH - 20, 25, align="topright")
-            draw_text(self.screen, f"高さ: {self.player.height} m", self.font_small, WHITE, SCREEN_WIDTH - 20, 65, align="topright")
-            distance_to_tsunami = self.tsunami.world_y - self.player.world_y
-            draw_text(self.screen, f"津波との距離: {max(0, int(distance_to_tsunami / 10))} m", self.font_small, WHITE, SCREEN_WIDTH - 20, 105, align="topright")
-            self.draw_notification(); pygame.display.flip()
+            self.interpolate_view(stepper.alpha()); self.update_visible_objects()
+            if self.dirty_renderer.enabled and self.governor.settings()["render_scale"] == 1:
+                camera = self.camera
+                if camera != last_camera: self.dirty_renderer.invalidate_all(); last_camera = camera
+                self.track_play_scene()
+                self.dirty_renderer.present(self.screen, self.draw_play_scene, self.profiler_overlay())
+            else:
+                self.draw_play_scene()
+                if self.profiler.overlay: self.profiler.draw_overlay(self.screen, self.debug_font())
+                pygame.display.flip()
+            prof.mark("flip"); latency.presented(time.perf_counter() * 1000)
             await asyncio.sleep(0) # ★ pygbag用
 
+    def hud_values(self):
+        distance_to_tsunami = self.tsunami.world_y - self.player.world_y
+        return int(self.player.stamina), self.tsunami.target_height, self.player.height, max(0, int(distance_to_tsunami / 10))
+
+    def draw_play_scene(self, area=None):
+        """プレイ画面を描く。area を渡すとその矩形だけを描き直す"""
+        screen = self.screen; screen.set_clip(area); scale = self.governor.settings()["render_scale"]
+        if scale != 1 and area is None: self.draw_world_low_res(scale)
+        else:
+            screen.fill(self.play_bg_color); self.tsunami.draw(screen, self.tsunami_top)
+            if area is None: screen.blits([(obj.image, obj.rect) for obj in self.visible_objects], False)
+            else:
+                for obj in self.visible_objects:
+                    if obj.rect.colliderect(area): screen.blit(obj.image, obj.rect)
+            screen.blit(self.player.image, self.player.rect)
+        self.stick.draw(screen)
+        stamina, target, height, distance = self.hud_values()
+        stamina_ratio = self.player.stamina / self.player.max_stamina
+        pygame.draw.rect(screen, RED, (10, 10, 200, 30)); pygame.draw.rect(screen, GREEN, (10, 10, 200 * stamina_ratio, 30));
+        self.hud_stamina.draw(screen, stamina)
+        self.hud_target.draw(screen, target)
+        self.hud_height.draw(screen, height)
+        self.hud_distance.draw(screen, distance)
+        if self.dirty_renderer.enabled: self.hud_pixels.draw(screen, self.dirty_renderer.last_pixels_pushed)
+        self.draw_notification()
+        screen.set_clip(None); self.profiler.mark("draw")
+
+    def scaled_image(self, image, scale):
+        scaled = self.scaled_images.get((image, scale))
+        if scaled is None:
+            w, h = image.get_size(); scaled = pygame.transform.scale(image, (max(1, w // scale), max(1, h // scale)))
+            if image.get_colorkey() is not None: scaled.set_colorkey(image.get_colorkey(), pygame.RLEACCEL)
+            self.scaled_images[(image, scale)] = scaled
+        return scaled
+
+    def draw_world_low_res(self, scale):
+        """背景・津波・オブジェクト・プレイヤーを 1/scale の解像度で描いて画面いっぱいに引き伸ばす。
+        出力の大きさ (SCALED の画面) は変えず、HUD はこの後に元の解像度で重ねる"""
+        size = (SCREEN_WIDTH // scale, SCREEN_HEIGHT // scale)
+        if self.low_res is None or self.low_res.get_size() != size: self.low_res = pygame.Surface(size).convert(self.screen)
+        low = self.low_res; low.fill(self.play_bg_color); self.tsunami.draw(low, self.tsunami_top // scale)
+        low.blits([(self.scaled_image(obj.image, scale), (obj.rect.x // scale, obj.rect.y // scale)) for obj in self.visible_objects], False)
+        player = self.player; low.blit(self.scaled_image(player.image, scale), (player.rect.x // scale, player.rect.y // scale))
+        pygame.transform.scale(low, self.screen.get_size(), self.screen)
+
+    def track_play_scene(self):
+        """ダーティ矩形モードで前フレームから変化した要素を登録する"""
+        tracker = self.dirty_renderer
+        for obj in self.visible_objects: tracker.track(obj, obj.rect)
+        tracker.track("player", self.player.rect)
+        tracker.track("tsunami_front", self.tsunami.crest_rect(self.tsunami_top), self.tsunami.anim_state(), sweep=True)
+        stamina, target, height, distance = self.hud_values()
+        tracker.track("stamina_bar", (10, 10, 200, 30), self.player.stamina)
+        tracker.track("hud_stamina", self.hud_stamina.layout(stamina), stamina)
+        tracker.track("hud_target", self.hud_target.layout(target), target)
+        tracker.track("hud_height", self.hud_height.layout(height), height)
+        tracker.track("hud_distance", self.hud_distance.layout(distance), distance)
+        tracker.track("hud_pixels", self.hud_pixels.layout(tracker.last_pixels_pushed), tracker.last_pixels_pushed)
+        tracker.track("notification", self.notification_rect(), self.notification_text)
+        stick_rect = self.stick.rect()
+        if stick_rect: tracker.track("stick", stick_rect, self.stick.vector())
+        if self.profiler.overlay: tracker.track("profiler_overlay", self.profiler.overlay_rect(), self.profiler.frames)
+
+    def unlock_achievement(self, ach_dict, key, message):
+        if ach_dict[key]["unlocked"]: return
+        ach_dict[key]["unlocked"] = True; self.set_notification(message); self.progress.set(f"ach.{key}", True)
+        self.menu.invalidate(f"ach_{key}")
+
     def check_achievements(self):
         ach_dict = self.hard_mode_achievements if self.is_hard_mode else self.achievements
-        if self.is_hard_mode:
-            if self.final_survival_time >= 120 and not ach_dict["hm_survived_2_min"]["unlocked"]: ach_dict["hm_survived_2_min"]["unlocked"] = True; self.set_notification("実績解除: ハード 2分間生存")
-            if self.final_survival_time >= 240 and not ach_dict["hm_survived_4_min"]["unlocked"]: ach_dict["hm_survived_4_min"]["unlocked"] = True; self.set_notification("実績解除: ハード 4分間生存")
-            if self.game_state == STATE_CLEAR:
-                if self.final_height >= 500 and not ach_dict["hm_cleared_500m"]["unlocked"]: ach_dict["hm_cleared_500m"]["unlocked"] = True; self.set_notification("実績解除: ハード 高さ500mクリア")
-                if self.final_height >= 1000 and not ach_dict["hm_cleared_1000m"]["unlocked"]: ach_dict["hm_cleared_1000m"]["unlocked"] = True; self.set_notification("実績解除: ハード 高さ1000mクリア")
-        else:
-            if self.final_survival_time >= 60 and not ach_dict["survived_1_min"]["unlocked"]: ach_dict["survived_1_min"]["unlocked"] = True; self.set_notification("実績解除: 1分間 生存する")
-            if self.final_survival_time >= 180 and not ach_dict["survived_3_min"]["unlocked"]: ach_dict["survived_3_min"]["unlocked"] = True; self.set_notification("実績解除: 3分間 生存する")
-            if self.game_state == STATE_CLEAR:
-                if self.final_height >= 300 and not ach_dict["cleared_300m"]["unlocked"]: ach_dict["cleared_300m"]["unlocked"] = True; self.set_notification("実績解除: 高さ300mをクリア")
-                if self.final_height >= 800 and not ach_dict["cleared_800m"]["unlocked"]: ach_dict["cleared_800m"]["unlocked"] = True; self.set_notification("実績解除: 高さ800mをクリア")
+        earned = earned_achievements("hard" if self.is_hard_mode else "normal", self.game_state, self.final_survival_time, self.final_height)
+        for key, message in earned: self.unlock_achievement(ach_dict, key, message)
         if not self.hard_mode_unlocked and all(ach['unlocked'] for ach in self.achievements.values()):
-            self.hard_mode_unlocked = True; self.set_notification("ハードモードが解放されました！")
+            self.hard_mode_unlocked = True; self.set_notification("ハードモードが解放されました！"); self.progress.set("hard_mode_unlocked", True)
+            self.menu.invalidate()
 
     async def show_end_screen(self, main_message, score_message):
         pygame.mouse.set_visible(True)
         retry_button = pygame.Rect(SCREEN_WIDTH/2 - 200, SCREEN_HEIGHT/2 + 50, 400, 80)
         title_button = pygame.Rect(SCREEN_WIDTH/2 - 200, SCREEN_HEIGHT/2 + 150, 400, 80)
+        menu = self.menu; menu.reset()
+        menu.add_text("main_message", main_message, self.font_large, RED, SCREEN_WIDTH/2, SCREEN_HEIGHT/4)
+        menu.add_text("score_message", score_message, self.font_medium, WHITE, SCREEN_WIDTH/2, SCREEN_HEIGHT/2 - 50)
+        menu.add_button("retry", retry_button, GRAY, "もう一度プレイ / R", self.font_small)
+        menu.add_button("title", title_button, GRAY, "タイトルに戻る / Q", self.font_small)
         waiting = True
         while waiting:
-            self.clock.tick(FPS); self.screen.fill(BLACK)
-            draw_text(self.screen, main_message, self.font_large, RED, SCREEN_WIDTH/2, SCREEN_HEIGHT/4)
-            draw_text(self.screen, score_message, self.font_medium, WHITE, SCREEN_WIDTH/2, SCREEN_HEIGHT/2 - 50)
-            pygame.draw.rect(self.screen, GRAY, retry_button); pygame.draw.rect(self.screen, GRAY, title_button)
-            draw_text(self.screen, "もう一度プレイ / R", self.font_small, WHITE, retry_button.centerx, retry_button.centery)
-            draw_text(self.screen, "タイトルに戻る / Q", self.font_small, WHITE, title_button.centerx, title_button.centery)
+            self.profiler.frame(); self.clock.tick(FPS); self.profiler.mark("idle")
             
             events = pygame.event.get()
             for event in events:
+                self.handle_window_event(event); self.handle_debug_key(event)
                 if event.type == pygame.QUIT: self.running = False; waiting = False
                 if event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_r: self.game_state = STATE_PLAYING; self.new_game(); waiting = False
@@ -481,7 +2135,7 @@ class Game:
                 if event.type == pygame.MOUSEBUTTONDOWN:
                     if retry_button.collidepoint(event.pos): self.game_state = STATE_PLAYING; self.new_game(); waiting = False
                     if title_button.collidepoint(event.pos): self.game_state = STATE_TITLE; waiting = False
-            pygame.display.flip()
+            self.profiler.mark("events"); self.sync_menu_notification(); menu.present(self.screen, self.profiler_overlay()); self.profiler.mark("flip")
             await asyncio.sleep(0) # ★ pygbag用 - ここを修正しました
 
 
@@ -491,19 +2145,24 @@ async def main():
     """ゲームのメインエントリーポイント (非同期)"""
     
     # 1. Pygameの初期化
-    pygame.init()
+    # pygame.init() は音声やジョイスティックまで全部初期化するので、最初のフレームに必要な
+    # display と font だけを先に立ち上げる (ミキサーは最初のクリックで初期化する)
+    startup = StartupReport()
     
     # 2. 画面とオブジェクトの作成
-    try:
-        # pygbag/ブラウザ環境では、画面スケーリングを試みる
-        screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SCALED)
-    except pygame.error:
-        # エラーが出た場合は、通常の初期化に戻す
-        screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-        
-    pygame.display.set_caption("津波から逃げろ！")
+    with startup.stage("display"):
+        pygame.display.init()
+        try:
+            # pygbag/ブラウザ環境では、画面スケーリングを試みる
+            screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SCALED)
+        except pygame.error:
+            # エラーが出た場合は、通常の初期化に戻す
+            screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+        pygame.display.set_caption("津波から逃げろ！")
+        install_event_filter()
+    with startup.stage("font"): pygame.font.init()
     
-    game = Game()
+    with startup.stage("game"): game = Game(startup)
     game.screen = screen # Gameクラスに画面オブジェクトを渡す
     game.running = True
 
@@ -516,7 +2175,7 @@ async def main():
             await game.show_rules_screen()
         elif game.game_state == STATE_ACHIEVEMENTS:
             await game.show_achievements_screen()
-        elif game.game_state == STATE_PLAYING:
+        elif game.game_state in (STATE_PLAYING, STATE_REPLAY):
             await game.play_game()
         # End Screen (GAME_OVER/CLEAR) は show_end_screen() で処理
         elif game.game_state == STATE_GAME_OVER or game.game_state == STATE_CLEAR:
@@ -525,21 +2184,31 @@ async def main():
             if game.game_state == STATE_CLEAR:
                 main_message = "クリア！"
                 score_message = f"到達高度: {game.final_height} m"
-                game.clear_sound.play()
+                game.sfx.play("clear")
             else: # STATE_GAME_OVER
                 main_message = "ゲームオーバー"
                 score_message = f"生存時間: {game.final_survival_time:.2f} 秒"
-                game.game_over_sound.play()
+                game.sfx.play("game_over")
                 
             await game.show_end_screen(main_message, score_message)
 
     # 4. 終了処理
+    game.progress.flush()  # 待ち時間中の変更を書き出す
     pygame.quit()
     sys.exit()
 
 
 # ★★★ pygbag/ブラウザ対応の実行ブロック ★★★
+def verify_replay(path):
+    """リプレイを画面なし・最高速で再生し、結果を表示する"""
+    sim = ReplayPlayer(path).run_headless()
+    print(f"{path}: seed={sim.seed} mode={sim.mode} ticks={sim.ticks} state={sim.state} height={sim.player.height} survival={sim.final_survival_time:.2f}s")
+    return sim
+
 if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "--verify-replay":
+        for replay_path in sys.argv[2:]: verify_replay(replay_path)
+        sys.exit()
     try:
         # 標準的なPython環境
         asyncio.run(main())